@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Measure the memory cost of MessageHistory per 100k stored lines.
+
+Usage: python benchmarks/history_memory.py [lines] [channels]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.history import MessageHistory
+
+WORDS = ('hello', 'world', 'the', 'bot', 'python', 'irc', 'channel', 'message', 'quote',
+         'seen', 'lol', 'yes', 'no', 'maybe', 'today', 'server', 'config', 'plugin')
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    rng = random.Random(0)
+    nicks = [f'user{i}' for i in range(500)]
+    texts = [' '.join(rng.choices(WORDS, k=rng.randint(3, 12))) for _ in range(lines)]
+
+    history = MessageHistory(max_lines_per_channel=lines, max_bytes=1 << 40)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for i, text in enumerate(texts):
+        history.add(f'#chan{i % channels}', nicks[i % len(nicks)], text, timestamp=i)
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # Texts are already allocated, so tracemalloc only sees the buffers and indexes
+    text_bytes = sum(sys.getsizeof(text) for text in texts)
+    per_100k = 100_000 / lines
+    print(f'lines stored:          {history.total_lines}')
+    print(f'insert time:           {elapsed:.3f}s ({elapsed / lines * 1e6:.2f}us/line)')
+    print(f'buffers + indexes:     {used * per_100k / 1024 / 1024:.2f} MiB per 100k lines')
+    print(f'including text:        {(used + text_bytes) * per_100k / 1024 / 1024:.2f} MiB per 100k lines')
+    print(f'accounted (estimate):  {history.memory_usage() * per_100k / 1024 / 1024:.2f} MiB per 100k lines')
+
+    started = time.perf_counter()
+    for i in range(1000):
+        history.last_by(f'#chan{i % channels}', nicks[i % len(nicks)])
+        history.last_matching(f'#chan{i % channels}', ' python ')
+        history.between(f'#chan{i % channels}', lines // 2, lines // 2 + 100)
+    print(f'1000 x 3 lookups:      {time.perf_counter() - started:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,19 +4,25 @@ import asyncio
 import os
 import sys
 
-from src.bot import Bot
+from src.startup import StartupProfiler
 
 
 def main():
+    profiler = StartupProfiler(enabled='--profile-startup' in sys.argv[1:])
     os.makedirs('data', exist_ok=True)
 
-    if len(sys.argv) < 2:
-        print('Usage: python elitebot.py <config_file>')
+    args = [arg for arg in sys.argv[1:] if arg != '--profile-startup']
+    if len(args) < 1:
+        print('Usage: python elitebot.py [--profile-startup] <config_file>')
         sys.exit(1)
 
-    config_file = sys.argv[1]
+    # Imported here so --profile-startup can time it
+    with profiler.phase('import src.bot'):
+        from src.bot import Bot
+
+    config_file = args[0]
     try:
-        bot = Bot(config_file)
+        bot = Bot(config_file, profiler)
     except FileNotFoundError as e:
         print(f'Config file not found: {e}')
         sys.exit(1)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import argparse
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import quote
+
+# first timestamp, last timestamp, byte offset, compressed length
+INDEX_RECORD = struct.Struct('<ddQI')
+CHANNEL_COMMANDS = {'PRIVMSG', 'NOTICE', 'JOIN', 'PART', 'KICK', 'MODE', 'TOPIC'}
+REDACTED_COMMANDS = {'AUTHENTICATE', 'PASS', 'OPER'}
+
+
+def strip_prefix(line):
+    """
+    Remove the message tags and the source prefix from a raw IRC line.
+    """
+    if line.startswith('@'):
+        line = line.partition(' ')[2].lstrip(' ')
+    if line.startswith(':'):
+        line = line.partition(' ')[2].lstrip(' ')
+    return line
+
+
+def stream_name(line):
+    """
+    Return the archive stream a raw IRC line belongs to: a channel name,
+    _private for private messages or _server for everything else.
+    """
+    parts = strip_prefix(line).split(' ', 2)
+    if len(parts) < 2:
+        return '_server'
+
+    command = parts[0].upper()
+    target = parts[1].lstrip(':')
+    if command in CHANNEL_COMMANDS and target[:1] in '#&' and ',' not in target:
+        return target.lower()
+    if command in ('PRIVMSG', 'NOTICE'):
+        return '_private'
+    return '_server'
+
+
+def stream_path(directory, network, stream):
+    return os.path.join(directory, quote(network, safe=''), quote(stream, safe='#&+!-_.'))
+
+
+class Segment:
+    """
+    A segment file and its sidecar index. The files are closed while the
+    segment is idle and reopened in append mode when written to again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = open(f'{path}.seg', 'xb')
+        self.index = open(f'{path}.idx', 'xb')
+        self.size = 0
+
+    @property
+    def is_open(self):
+        return self.data is not None
+
+    def reopen(self):
+        self.data = open(f'{self.path}.seg', 'ab')
+        try:
+            self.index = open(f'{self.path}.idx', 'ab')
+        except OSError:
+            self.data.close()
+            self.data = None
+            raise
+
+    def write_block(self, first_ts, last_ts, payload):
+        self.data.write(payload)
+        self.data.flush()
+        # The index record goes last so it never points at missing data
+        self.index.write(INDEX_RECORD.pack(first_ts, last_ts, self.size, len(payload)))
+        self.index.flush()
+        self.size += len(payload)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.index.close()
+            self.data = self.index = None
+
+
+class Stream:
+    """
+    Pending lines and the current segment of one network/channel stream.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.first_ts = None
+        self.last_ts = None
+        self.segment = None
+
+    def open_segment(self):
+        os.makedirs(self.path, exist_ok=True)
+        stamp = int(self.first_ts * 1000)
+        while os.path.exists(os.path.join(self.path, f'{stamp:015d}.seg')):
+            stamp += 1
+        self.segment = Segment(os.path.join(self.path, f'{stamp:015d}'))
+
+
+class TrafficArchive:
+    """
+    Append-only archive of every line the bot receives and sends.
+
+    Lines are queued by record() and written by a background thread, which
+    batches them per network/channel into zlib-compressed blocks. Blocks are
+    appended to size-rotated segment files, and every block gets a record in
+    a sidecar index so queries only decompress the blocks they need. Only
+    the most recently written max_open_segments segments keep their files
+    open, so the number of channels is not limited by file descriptors.
+    """
+
+    def __init__(self, directory, network, logger, segment_size=64 * 1024 * 1024, block_lines=256,
+                 flush_interval=5.0, max_open_segments=64):
+        self.directory = directory
+        self.network = network
+        self.logger = logger
+        self.segment_size = segment_size
+        self.block_lines = block_lines
+        self.flush_interval = flush_interval
+        self.max_open_segments = max_open_segments
+        self.queue = queue.SimpleQueue()
+        self.streams = {}
+        # Segments with open files, least recently written first
+        self.open_segments = OrderedDict()
+        self.thread = threading.Thread(target=self.run, name='traffic-archive', daemon=True)
+        self.thread.start()
+
+    def record(self, direction, line):
+        """
+        Queue a raw line for archiving. Safe to call from the event loop.
+
+        :param direction: '<' for received lines, '>' for sent lines
+        :param line: The raw IRC line without CRLF
+        """
+        self.queue.put((time.time(), direction, line))
+
+    def close(self):
+        """
+        Flush all pending blocks and stop the writer thread. Blocks until done.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                break
+            if item:
+                self.append(*item)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush_all()
+                last_flush = time.monotonic()
+
+        self.flush_all()
+        for segment in self.open_segments:
+            segment.close()
+        self.open_segments.clear()
+
+    def append(self, timestamp, direction, line):
+        command, _, params = strip_prefix(line).partition(' ')
+        if command.upper() in REDACTED_COMMANDS and params:
+            line = f'{command} *'
+
+        name = stream_name(line)
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = Stream(stream_path(self.directory, self.network, name))
+
+        if stream.first_ts is None:
+            stream.first_ts = timestamp
+        stream.last_ts = timestamp
+        stream.lines.append(f'{timestamp:.6f} {direction} {line}\n')
+        if len(stream.lines) >= self.block_lines:
+            self.flush(stream)
+
+    def flush_all(self):
+        for stream in self.streams.values():
+            if stream.lines:
+                self.flush(stream)
+
+    def flush(self, stream):
+        payload = zlib.compress(''.join(stream.lines).encode('UTF-8', 'surrogateescape'))
+        try:
+            if stream.segment is None or stream.segment.size >= self.segment_size:
+                if stream.segment:
+                    self.close_segment(stream.segment)
+                stream.open_segment()
+            elif not stream.segment.is_open:
+                stream.segment.reopen()
+            self.open_segments[stream.segment] = None
+            self.open_segments.move_to_end(stream.segment)
+            while len(self.open_segments) > self.max_open_segments:
+                self.open_segments.popitem(last=False)[0].close()
+            stream.segment.write_block(stream.first_ts, stream.last_ts, payload)
+        except OSError as e:
+            self.logger.error(f'Error writing traffic archive {stream.path}: {e}')
+            if stream.segment:
+                self.close_segment(stream.segment)
+            stream.segment = None
+        stream.lines = []
+        stream.first_ts = None
+
+    def close_segment(self, segment):
+        self.open_segments.pop(segment, None)
+        segment.close()
+
+
+def query(directory, network, channel, since, until):
+    """
+    Yield archived lines of a channel with since <= timestamp <= until.
+
+    Only index files are scanned (memory-mapped) and only the blocks that
+    overlap the time range are read and decompressed.
+    """
+    path = stream_path(directory, network, channel.lower())
+    if not os.path.isdir(path):
+        return
+
+    for filename in sorted(f for f in os.listdir(path) if f.endswith('.idx')):
+        index_file = os.path.join(path, filename)
+        if os.path.getsize(index_file) < INDEX_RECORD.size:
+            continue
+
+        with open(index_file, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            count = len(index) // INDEX_RECORD.size
+            if INDEX_RECORD.unpack_from(index, 0)[0] > until:
+                break
+            if INDEX_RECORD.unpack_from(index, (count - 1) * INDEX_RECORD.size)[1] < since:
+                continue
+
+            # Binary search for the first block ending at or after since
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if INDEX_RECORD.unpack_from(index, mid * INDEX_RECORD.size)[1] < since:
+                    lo = mid + 1
+                else:
+                    hi = mid
+
+            with open(index_file[:-4] + '.seg', 'rb') as segment:
+                for i in range(lo, count):
+                    first_ts, _, offset, length = INDEX_RECORD.unpack_from(index, i * INDEX_RECORD.size)
+                    if first_ts > until:
+                        return
+                    segment.seek(offset)
+                    block = zlib.decompress(segment.read(length)).decode('UTF-8', 'surrogateescape')
+                    for line in block.splitlines():
+                        if since <= float(line.split(' ', 1)[0]) <= until:
+                            yield line
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the EliteBot traffic archive')
+    parser.add_argument('directory', help='Archive directory, e.g. data/archive')
+    parser.add_argument('network', help='Network name the archive was written for')
+    parser.add_argument('channel', help='Channel, _private or _server')
+    parser.add_argument('since', help='Start time as Unix time or ISO 8601')
+    parser.add_argument('until', nargs='?', help='End time as Unix time or ISO 8601, defaults to now')
+    args = parser.parse_args()
+
+    until = parse_time(args.until) if args.until else time.time()
+    for line in query(args.directory, args.network, args.channel, parse_time(args.since), until):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
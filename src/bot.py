@@ -3,62 +3,110 @@
 import asyncio
 import importlib.util
 import inspect
-import json
 import os
+import re
+import signal
 import ssl
 import sys
+from collections import deque
+from datetime import datetime
 
-import yaml
-
+from src.archive import TrafficArchive
+from src.capabilities import CapabilityManager
 from src.channel_manager import ChannelManager
+from src.config import (RECONNECT_SECTIONS, RESTART_SECTIONS, ConfigError, diff_config, load_config,
+                        with_sections)
+from src.history import MessageHistory
+from src.identity import IdentityService
 from src.logger import Logger
+from src.permissions import PermissionTable
 from src.plugin_base import PluginBase
-from src.sasl import handle_sasl, handle_authenticate, handle_903
+from src.sasl import handle_authenticate, handle_903
+from src.startup import StartupProfiler
+
+TAG_UNESCAPE_RE = re.compile(r'\\(.?)')
+TAG_UNESCAPES = {':': ';', 's': ' ', 'r': '\r', 'n': '\n'}
+
+# Handled as soon as they arrive, everything else waits for the database and plugins
+EARLY_COMMANDS = {'CAP', 'PING', 'AUTHENTICATE', 'ERROR', '001', '903', '904', '905', '906', '907'}
+MAX_PENDING_EVENTS = 10000
+# 8191 bytes of tags plus a 512 byte message, as allowed by IRCv3 message-tags
+MAX_LINE_LENGTH = 8191 + 512
 
 
 class Bot:
-    def __init__(self, config_file):
-        self.config = self.load_config(config_file)
-        self.validate_config(self.config)
-        self.connection_string = self.config['Database'].get('ConnectionString')
-        self.channel_manager = ChannelManager()
+    def __init__(self, config_file, profiler=None):
         self.logger = Logger('logs/elitebot.log')
+        self.config_file = config_file
+        self.profiler = profiler or StartupProfiler()
+        try:
+            with self.profiler.phase('load config'):
+                self.config = load_config(config_file)
+        except FileNotFoundError as e:
+            self.logger.error(f'Error loading config file: {e}')
+            raise
+        except ConfigError as e:
+            self.logger.error(f'Error in config file: {e}')
+            raise
+        self.logger.set_level(self.config.logging.level)
+        # Latest contents of the config file, including changes not applied yet
+        self.file_config = self.config
+        self.connection_string = self.config.database.connection_string
+        self.channel_manager = ChannelManager()
         self.connected = False
         self.reader = None
         self.writer = None
         self.running = True
         self.plugins = []
-        self.load_plugins()
-
-    def validate_config(self, config):
-        required_fields = [
-            ['Connection', 'Port'],
-            ['Connection', 'Hostname'],
-            ['Connection', 'Nick'],
-            ['Connection', 'Ident'],
-            ['Connection', 'Name'],
-            ['Database', 'ConnectionString']
-        ]
-
-        for field in required_fields:
-            if not self.get_nested_config_value(config, field):
-                raise ValueError(f'Missing required config field: {" -> ".join(field)}')
-
-    def get_nested_config_value(self, config, keys):
-        value = config
-        for key in keys:
-            value = value.get(key)
-            if value is None:
-                return None
-        return value
-
-    def load_plugins(self):
-        self.plugins = []
+        self.ready = asyncio.Event()
+        self.pending_events = deque(maxlen=MAX_PENDING_EVENTS)
+        self.init_task = None
+        self.tasks = set()
+        self.caps = CapabilityManager(self, self.config.capabilities)
+        self.identity = IdentityService(self, self.config.identity.max_entries)
+        self.permissions = PermissionTable(self.config.permissions.accounts, self.config.permissions.masks)
+        self.command_roles = {}
+        self.history = MessageHistory(
+            max_lines_per_channel=self.config.history.max_lines_per_channel,
+            max_bytes=int(self.config.history.max_memory_mb * 1024 * 1024)
+        )
+        self.archive = None
+        archive_config = self.config.archive
+        if archive_config.enabled:
+            self.archive = TrafficArchive(
+                archive_config.directory,
+                archive_config.network or self.config.connection.hostname,
+                self.logger,
+                segment_size=int(archive_config.segment_size_mb * 1024 * 1024),
+                block_lines=archive_config.block_lines,
+                flush_interval=archive_config.flush_seconds,
+                max_open_segments=archive_config.max_open_segments
+            )
+
+    def build_command_roles(self):
+        """
+        Map command names to required roles: built-in defaults, then roles
+        declared by plugins, then the Permissions -> Commands config
+        """
+        command_roles = {'join': 'admin', 'part': 'admin', 'rehash': 'admin'}
+        for plugin in self.plugins:
+            for cmd, role in getattr(plugin, 'command_roles', {}).items():
+                command_roles[cmd.lower()] = role
+        command_roles.update(self.config.permissions.commands)
+        self.command_roles = command_roles
+
+    def import_plugins(self):
+        """
+        Import all plugin modules. This blocks, so the bot runs it in a worker thread
+
+        :return: List of (filename, module) tuples
+        """
+        modules = []
         plugin_folder = './plugins'
         
         if not os.path.exists(plugin_folder):
             self.logger.warning(f"Plugin folder '{plugin_folder}' does not exist")
-            return
+            return modules
         
         # Add plugin folder to Python path
         sys.path.insert(0, plugin_folder)
@@ -71,47 +119,167 @@ class Bot:
                         filepath = os.path.join(plugin_folder, filename)
                         spec = importlib.util.spec_from_file_location(module_name, filepath)
                         module = importlib.util.module_from_spec(spec)
-                        spec.loader.exec_module(module)
-                        
-                        # Look for classes that inherit from PluginBase
-                        for name, obj in inspect.getmembers(module):
-                            if (inspect.isclass(obj) and 
-                                issubclass(obj, PluginBase) and 
-                                obj is not PluginBase):
-                                try:
-                                    plugin_instance = obj(self)
-                                    self.plugins.append(plugin_instance)
-                                    self.logger.info(f"Loaded plugin: {name}")
-                                    
-                                    # Call on_connect if method exists
-                                    if hasattr(plugin_instance, 'on_connect'):
-                                        plugin_instance.on_connect()
-                                except Exception as e:
-                                    self.logger.error(f"Error initializing plugin {name}: {e}")
+                        with self.profiler.phase(f'import {filename}'):
+                            spec.loader.exec_module(module)
+                        modules.append((filename, module))
                     except Exception as e:
                         self.logger.error(f"Error loading plugin {filename}: {e}")
         except Exception as e:
             self.logger.error(f"Error loading plugins: {e}")
+        return modules
+
+    def load_plugins(self, modules):
+        """
+        Instantiate the plugin classes of imported modules on the event loop
+
+        :param modules: List of (filename, module) tuples from import_plugins
+        """
+        self.plugins = []
+        for filename, module in modules:
+            # Look for classes that inherit from PluginBase
+            for name, obj in inspect.getmembers(module):
+                if (inspect.isclass(obj) and 
+                    issubclass(obj, PluginBase) and 
+                    obj is not PluginBase):
+                    try:
+                        plugin_instance = obj(self)
+                        self.plugins.append(plugin_instance)
+                        self.logger.info(f"Loaded plugin: {name}")
+                        
+                        # Call on_connect if method exists
+                        if hasattr(plugin_instance, 'on_connect'):
+                            plugin_instance.on_connect()
+                    except Exception as e:
+                        self.logger.error(f"Error initializing plugin {name}: {e}")
         
         self.logger.info(f"Loaded {len(self.plugins)} plugins")
+        self.build_command_roles()
 
-    def load_config(self, config_file):
-        _, ext = os.path.splitext(config_file)
+    async def initialize(self):
+        """
+        Open the database and load plugins in the background while the bot
+        connects, then replay the events that arrived in the meantime
+        """
         try:
-            with open(config_file, 'r') as file:
-                if ext == '.json':
-                    config = json.load(file)
-                elif ext == '.yaml' or ext == '.yml':
-                    config = yaml.safe_load(file)
-                else:
-                    raise ValueError(f'Unsupported file extension: {ext}')
-        except FileNotFoundError as e:
-            self.logger.error(f'Error loading config file: {e}')
-            raise
-        except (json.JSONDecodeError, yaml.YAMLError) as e:
-            self.logger.error(f'Error parsing config file: {e}')
-            raise
-        return config
+            with self.profiler.phase('import database'):
+                await asyncio.to_thread(importlib.import_module, 'src.db')
+            with self.profiler.phase('database'):
+                await asyncio.to_thread(self.channel_manager.load)
+        except Exception as e:
+            self.logger.error(f'Error initializing database: {e}')
+
+        try:
+            with self.profiler.phase('plugins'):
+                modules = await asyncio.to_thread(self.import_plugins)
+                self.load_plugins(modules)
+        except Exception as e:
+            self.logger.error(f'Error loading plugins: {e}')
+        finally:
+            # Never leave buffered events and autojoin waiting on a failed startup.
+            # Events that arrive during the replay are queued behind it, so order is kept
+            with self.profiler.phase('replay events'):
+                replayed = len(self.pending_events)
+                while self.pending_events:
+                    message = self.pending_events.popleft()
+                    try:
+                        await self.process_message(message, replay=True)
+                    except Exception as e:
+                        self.logger.error(f'Error processing message "{message}": {e}')
+            self.ready.set()
+            self.profiler.mark('ready')
+            self.logger.info(f'Initialization complete, replayed {replayed} buffered events')
+
+    async def autojoin(self):
+        """
+        Join saved and configured channels once registered and initialized
+        """
+        await self.ready.wait()
+        for channel in self.autojoin_channels():
+            try:
+                await self.ircsend(f'JOIN {channel}')
+                self.logger.info(f'Auto-joined channel: {channel}')
+            except Exception as e:
+                self.logger.error(f'Error joining channel {channel}: {e}')
+
+        if self.profiler.enabled and not self.profiler.reported:
+            self.profiler.reported = True
+            self.profiler.mark('autojoin')
+            for line in self.profiler.report():
+                self.logger.info(line)
+
+    def autojoin_channels(self):
+        """
+        Channels to join on connect: saved channels plus the Channels config list
+        """
+        channels = [channel[1] for channel in self.channel_manager.get_channels()]
+        known = {channel.lower() for channel in channels}
+        channels += [channel for channel in self.config.channels if channel.lower() not in known]
+        return channels
+
+    async def reload_config(self):
+        """
+        Reload the config file and apply the changes that don't need a reconnect.
+        Connection and SASL changes are applied on the next connect; Database
+        and Archive changes only after a restart
+
+        :return: Tuple of (changed section names, fields that need a reconnect,
+                 fields that need a restart), or None if the new config is
+                 invalid and was not applied
+        """
+        try:
+            new_config = load_config(self.config_file)
+        except (OSError, ConfigError) as e:
+            self.logger.error(f'Config reload failed, keeping current config: {e}')
+            return None
+
+        old_config = self.config
+        changed, reconnect, restart = diff_config(old_config, new_config)
+        old_autojoin = {channel.lower() for channel in self.autojoin_channels()}
+        # The live connection keeps its settings until the next connect
+        self.file_config = new_config
+        self.config = with_sections(new_config, old_config, RECONNECT_SECTIONS + RESTART_SECTIONS)
+
+        if 'logging' in changed:
+            self.logger.set_level(new_config.logging.level)
+        if 'history' in changed:
+            self.history.set_limits(new_config.history.max_lines_per_channel,
+                                    int(new_config.history.max_memory_mb * 1024 * 1024))
+        if 'identity' in changed:
+            self.identity.set_max_entries(new_config.identity.max_entries)
+        if 'permissions' in changed:
+            self.permissions = PermissionTable(new_config.permissions.accounts, new_config.permissions.masks)
+            self.build_command_roles()
+        if 'capabilities' in changed:
+            self.caps.wanted = set(new_config.capabilities)
+            if self.connected:
+                await self.caps.sync()
+        if 'channels' in changed and self.connected:
+            new_autojoin = {channel.lower(): channel for channel in self.autojoin_channels()}
+            for key, channel in new_autojoin.items():
+                if key not in old_autojoin:
+                    await self.ircsend(f'JOIN {channel}')
+            for channel in old_config.channels:
+                if channel.lower() not in new_autojoin:
+                    await self.ircsend(f'PART {channel}')
+        if 'plugins' in changed:
+            for plugin in self.plugins:
+                name = plugin.__class__.__name__
+                settings = new_config.plugins.get(name, {})
+                if settings != old_config.plugins.get(name, {}):
+                    try:
+                        plugin.on_config_change(settings)
+                    except Exception as e:
+                        self.logger.error(f'Error in plugin {name} config change: {e}')
+
+        if changed:
+            self.logger.info(f'Config reloaded, changed: {", ".join(changed)}')
+        else:
+            self.logger.info('Config reloaded, no changes')
+        if reconnect:
+            self.logger.warning(f'Config changes that apply on the next reconnect: {", ".join(reconnect)}')
+        if restart:
+            self.logger.warning(f'Config changes that need a restart were not applied: {", ".join(restart)}')
+        return changed, reconnect, restart
 
     def decode(self, bytes):
         for encoding in ['utf-8', 'latin1', 'iso-8859-1', 'cp1252']:
@@ -126,6 +294,8 @@ class Bot:
         try:
             if msg != '':
                 self.logger.info(f'Sending command: {msg}')
+                if self.archive:
+                    self.archive.record('>', msg)
                 self.writer.write(bytes(f'{msg}\r\n', 'UTF-8'))
                 await self.writer.drain()
         except Exception as e:
@@ -141,6 +311,78 @@ class Bot:
     async def notice(self, target, msg):
         await self.ircsend(f'NOTICE {target} :{msg}')
 
+    def record_history(self, source_nick, target, message_text, kind, tags):
+        """
+        Store an incoming line in the shared message history
+
+        :param source_nick: Nick of the user who sent the line
+        :param target: Channel or nick the line was sent to
+        :param message_text: Content of the line
+        :param kind: PRIVMSG or NOTICE
+        :param tags: IRCv3 message tags, the server-time tag is used when present
+        """
+        if message_text.startswith('\x01ACTION ') and kind == 'PRIVMSG':
+            message_text = message_text[8:].rstrip('\x01')
+            kind = 'ACTION'
+        elif message_text.startswith('\x01'):
+            return
+
+        # Private lines are grouped by the other party's nick
+        channel = target if target[:1] in '#&' else source_nick
+        self.history.add(channel, source_nick, message_text, kind, self.server_time(tags))
+
+    def spawn(self, coro):
+        """
+        Run a coroutine as a background task, keeping a reference to it and
+        logging its exception if it fails
+        """
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+        return task
+
+    def task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f'Error in background task: {task.exception()}')
+
+    async def dispatch_privmsg(self, source_nick, channel, message_text):
+        """
+        Handle commands, CTCP VERSION and plugins for a PRIVMSG
+
+        :param source_nick: Nick of the user who sent the message
+        :param channel: Channel (or our nick) the message was sent to
+        :param message_text: Content of the message
+        """
+        # Commands may wait on the server (e.g. WHOX for permissions), so they run as
+        # a task instead of blocking the read loop that delivers the reply
+        if message_text.startswith('&'):
+            cmd, *cmd_args = message_text[1:].split()
+            if cmd:
+                self.spawn(self.handle_command(source_nick, channel, cmd, cmd_args))
+
+        # Handle CTCP VERSION
+        if message_text.startswith('\x01VERSION\x01'):
+            await self.ircsend(f'NOTICE {source_nick} :\x01VERSION EliteBot {self.config.version}\x01')
+
+        # Pass message to plugins
+        for plugin in self.plugins:
+            try:
+                await plugin.handle_message(source_nick, channel, message_text)
+            except Exception as e:
+                self.logger.error(f'Error in plugin {plugin.__class__.__name__}: {e}')
+
+    async def has_role(self, nick, role):
+        """
+        Check whether a nick has a role, querying the server only if the
+        account isn't already known
+
+        :param nick: Nick to check
+        :param role: Role name from the Permissions config
+        """
+        identity = await self.identity.resolve(nick)
+        return self.permissions.check(identity, role)
+
     async def handle_command(self, source_nick, channel, cmd, cmd_args):
         """
         Handle bot commands starting with &
@@ -151,19 +393,40 @@ class Bot:
         :param cmd_args: List of command arguments
         """
         try:
+            role = self.command_roles.get(cmd.lower())
+            if role and not await self.has_role(source_nick, role):
+                self.logger.warning(f'{source_nick} is not allowed to use {cmd}')
+                await self.privmsg(channel, f'{source_nick}: Permission denied')
+                return
+
             # Built-in commands
             if cmd.lower() == 'help':
-                await self.privmsg(channel, f'{source_nick}: Available commands: help, version, ping, join, part')
+                await self.privmsg(channel, f'{source_nick}: Available commands: help, version, ping, join, part, rehash')
             elif cmd.lower() == 'version':
-                await self.privmsg(channel, f'{source_nick}: EliteBot v{self.config.get("VERSION", "1.0.0")}')
+                await self.privmsg(channel, f'{source_nick}: EliteBot v{self.config.version}')
             elif cmd.lower() == 'ping':
                 await self.privmsg(channel, f'{source_nick}: Pong!')
+            elif cmd.lower() == 'rehash':
+                result = await self.reload_config()
+                if result is None:
+                    await self.privmsg(channel, f'{source_nick}: Config reload failed, see log')
+                else:
+                    changed, reconnect, restart = result
+                    await self.privmsg(channel, f'{source_nick}: Config reloaded, changed: {", ".join(changed) or "nothing"}')
+                    if reconnect:
+                        await self.privmsg(channel, f'{source_nick}: Needs a reconnect: {", ".join(reconnect)}')
+                    if restart:
+                        await self.privmsg(channel, f'{source_nick}: Needs a restart: {", ".join(restart)}')
             elif cmd.lower() == 'join' and cmd_args:
                 target_channel = cmd_args[0]
                 if target_channel.startswith('#'):
                     await self.ircsend(f'JOIN {target_channel}')
-                    self.channel_manager.save_channel(target_channel)
-                    await self.privmsg(channel, f'{source_nick}: Joined {target_channel}')
+                    if self.channel_manager.save_channel(target_channel):
+                        await self.privmsg(channel, f'{source_nick}: Joined {target_channel}')
+                    else:
+                        self.logger.warning(f'Database unavailable, {target_channel} was not saved')
+                        await self.privmsg(channel, f'{source_nick}: Joined {target_channel}, but the database is '
+                                                    f'unavailable so it will not be rejoined after a restart')
                 else:
                     await self.privmsg(channel, f'{source_nick}: Invalid channel name')
             elif cmd.lower() == 'part':
@@ -174,9 +437,14 @@ class Bot:
                 
                 if target_channel.startswith('#'):
                     await self.ircsend(f'PART {target_channel}')
-                    self.channel_manager.remove_channel(target_channel)
+                    removed = self.channel_manager.remove_channel(target_channel)
+                    if not removed:
+                        self.logger.warning(f'Database unavailable, {target_channel} was not removed')
+                    note = '' if removed else ', but the database is unavailable so it may be rejoined after a restart'
                     if target_channel != channel:
-                        await self.privmsg(channel, f'{source_nick}: Left {target_channel}')
+                        await self.privmsg(channel, f'{source_nick}: Left {target_channel}{note}')
+                    elif note:
+                        await self.privmsg(source_nick, f'Left {target_channel}{note}')
                 else:
                     await self.privmsg(channel, f'{source_nick}: Invalid channel name')
             else:
@@ -196,6 +464,33 @@ class Bot:
             self.logger.error(f'Error handling command "{cmd}": {e}')
             await self.privmsg(channel, f'{source_nick}: Error processing command')
 
+    def split_tags(self, message):
+        """
+        Split IRCv3 message tags off a raw line
+
+        :return: Tuple of (tags dict, rest of the line)
+        """
+        if not message.startswith('@'):
+            return {}, message
+        raw_tags, _, message = message[1:].partition(' ')
+        tags = {}
+        for tag in raw_tags.split(';'):
+            key, _, value = tag.partition('=')
+            tags[key] = TAG_UNESCAPE_RE.sub(lambda m: TAG_UNESCAPES.get(m.group(1), m.group(1)), value)
+        return tags, message.lstrip(' ')
+
+    def server_time(self, tags):
+        """
+        Return the Unix time of the server-time tag, or None
+        """
+        value = tags.get('time')
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return None
+
     def parse_message(self, message):
         parts = message.split()
         if not parts:
@@ -216,25 +511,24 @@ class Bot:
         return source, command, args
 
     async def connect(self):
+        # Connection and SASL changes from a config reload take effect now
+        self.config = with_sections(self.config, self.file_config, RECONNECT_SECTIONS)
         try:
             ssl_context = None
-            if str(self.config['Connection'].get('Port'))[:1] == '+':
-                ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)  # Corrected here
+            connection = self.config.connection
+            if connection.tls:
+                ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
 
             self.reader, self.writer = await asyncio.open_connection(
-                self.config['Connection'].get('Hostname'),
-                int(self.config['Connection'].get('Port')[1:]) if ssl_context else int(
-                    self.config['Connection'].get('Port')),
+                connection.hostname,
+                connection.port,
                 ssl=ssl_context
             )
 
-            if self.config['SASL'].get('UseSASL'):
-                await self.ircsend('CAP LS 302')
-            await self.ircsend(f'NICK {self.config["Connection"].get("Nick")}')
-            await self.ircsend(f'USER {self.config["Connection"].get("Ident")} * * :'
-                               f'{self.config["Connection"].get("Name")}')
-            if self.config['SASL'].get('UseSASL'):
-                await self.ircsend('CAP REQ :sasl')
+            self.identity.reset()
+            await self.caps.start()
+            await self.ircsend(f'NICK {connection.nick}')
+            await self.ircsend(f'USER {connection.ident} * * :{connection.name}')
         except Exception as e:
             self.logger.error(f'Error establishing connection: {e}')
             self.connected = False
@@ -245,7 +539,7 @@ class Bot:
             await asyncio.sleep(60)
             if self.connected:
                 try:
-                    await self.ircsend(f'PING :{self.config["Connection"].get("Hostname")}')
+                    await self.ircsend(f'PING :{self.config.connection.hostname}')
                 except Exception as e:
                     self.logger.error(f'Error sending ping: {e}')
                     self.connected = False
@@ -257,6 +551,9 @@ class Bot:
         """
         self.logger.info("Shutting down bot...")
         self.running = False
+
+        if self.init_task and not self.init_task.done():
+            self.init_task.cancel()
         
         # Call plugin disconnect handlers
         for plugin in self.plugins:
@@ -281,11 +578,35 @@ class Bot:
                 await self.writer.wait_closed()
             except Exception as e:
                 self.logger.error(f'Error closing connection: {e}')
+
+        # Flush the traffic archive without blocking the event loop
+        if self.archive:
+            try:
+                await asyncio.to_thread(self.archive.close)
+            except Exception as e:
+                self.logger.error(f'Error closing traffic archive: {e}')
         
         self.logger.info("Bot shutdown complete")
             
+    def install_signal_handlers(self):
+        """
+        Reload the config on SIGHUP where the platform supports it
+        """
+        if not hasattr(signal, 'SIGHUP'):
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, lambda: self.spawn(self.reload_config()))
+        except (NotImplementedError, RuntimeError) as e:
+            self.logger.warning(f'Could not install SIGHUP handler: {e}')
+
     async def start(self):
+        self.install_signal_handlers()
+        # Runs while the first connection attempt is in progress
+        if self.init_task is None:
+            self.init_task = asyncio.create_task(self.initialize())
         ping_task = None
+        read_buffer = b''
         reconnect_delay = 30  # Start with 30 second delay
         max_reconnect_delay = 300  # Maximum 5 minute delay
         
@@ -293,8 +614,10 @@ class Bot:
             if not self.connected:
                 try:
                     self.logger.info("Attempting to connect to IRC server...")
-                    await self.connect()
+                    with self.profiler.phase('connect'):
+                        await self.connect()
                     self.connected = True
+                    read_buffer = b''
                     reconnect_delay = 30  # Reset delay on successful connection
                     self.logger.info("Successfully connected to IRC server")
                     
@@ -320,21 +643,22 @@ class Bot:
                     self.connected = False
                     continue
 
-                ircmsg = self.decode(recvText)
-                self.logger.debug(f'Raw IRC message: {ircmsg.strip()}')
-
-                # Handle multiple messages in one packet
-                if '\r\n' in ircmsg:
-                    messages = ircmsg.split('\r\n')
-                elif '\n' in ircmsg:
-                    messages = ircmsg.split('\n')
-                else:
-                    messages = [ircmsg]
-
-                for message in messages:
-                    if message.strip():  # Only process non-empty messages
+                # A read can end mid-line; keep the unfinished tail for the next read so
+                # it is never parsed (and its source trusted) as a line of its own
+                read_buffer += recvText
+                *lines, read_buffer = read_buffer.split(b'\n')
+                if len(read_buffer) > MAX_LINE_LENGTH:
+                    self.logger.warning('Discarding overlong unterminated line from server')
+                    read_buffer = b''
+
+                for line in lines:
+                    message = self.decode(line).strip()
+                    if message:  # Only process non-empty messages
+                        self.logger.debug(f'Raw IRC message: {message}')
+                        if self.archive:
+                            self.archive.record('<', message)
                         try:
-                            await self.process_message(message.strip())
+                            await self.process_message(message)
                         except Exception as e:
                             self.logger.error(f'Error processing message "{message}": {e}')
                             # Continue processing other messages
@@ -354,21 +678,39 @@ class Bot:
                 await asyncio.sleep(5)  # Brief pause before retry
                 continue
 
-    async def process_message(self, message):
+    async def process_message(self, message, replay=False):
         """
         Process a single IRC message with proper error handling
+
+        :param message: Raw IRC line
+        :param replay: True when replaying an event buffered during startup
         """
         try:
+            raw_message = message
+            tags, message = self.split_tags(message)
             source, command, args = self.parse_message(message)
-            self.logger.debug(f'Parsed: source={source} | command={command} | args={args}')
+            self.logger.debug(f'Parsed: tags={tags} | source={source} | command={command} | args={args}')
 
             if not command:
                 return
 
+            # Labeled replies are routed as they arrive, so a request() made during
+            # startup is not left waiting on a reply held in the startup buffer
+            if not replay:
+                self.caps.handle_tags(tags, source, command, args)
+
+            # Until the database and plugins are ready, only registration is handled
+            if not self.ready.is_set() and not replay and command not in EARLY_COMMANDS:
+                if len(self.pending_events) == self.pending_events.maxlen:
+                    self.logger.warning('Startup event buffer full, dropping oldest event')
+                self.pending_events.append(raw_message)
+                return
+
+            self.identity.observe(source, tags)
+
             match command:
                 case 'CAP':
-                    if len(args) >= 3 and args[1] == 'ACK' and 'sasl' in args[2]:
-                        await handle_sasl(self.config, self.ircsend)
+                    await self.caps.handle(args)
                         
                 case 'PING':
                     nospoof = args[0][1:] if args[0].startswith(':') else args[0]
@@ -378,23 +720,45 @@ class Bot:
                     if len(args) >= 2:
                         channel, message_text = args[0], args[1]
                         source_nick = source.split('!')[0] if source else 'unknown'
-
-                        # Handle commands
-                        if message_text.startswith('&'):
-                            cmd, *cmd_args = message_text[1:].split()
-                            await self.handle_command(source_nick, channel, cmd, cmd_args)
-
-                        # Handle CTCP VERSION
-                        if message_text.startswith('\x01VERSION\x01'):
-                            await self.ircsend(f'NOTICE {source_nick} :\x01VERSION EliteBot {self.config.get("VERSION", "1.0.0")}\x01')
-
-                        # Pass message to plugins
-                        for plugin in self.plugins:
-                            try:
-                                await plugin.handle_message(source_nick, channel, message_text)
-                            except Exception as e:
-                                self.logger.error(f'Error in plugin {plugin.__class__.__name__}: {e}')
+                        self.record_history(source_nick, channel, message_text, 'PRIVMSG', tags)
+                        # Plugins see lines in arrival order, only commands run in the background
+                        await self.dispatch_privmsg(source_nick, channel, message_text)
                                 
+                case 'NOTICE':
+                    # Only user notices, server notices have no nick!user@host source
+                    if len(args) >= 2 and source and '!' in source:
+                        self.record_history(source.split('!')[0], args[0], args[1], 'NOTICE', tags)
+
+                case 'JOIN':
+                    self.identity.on_join(source, args)
+                    # Fill the identity cache for everyone in a channel we joined
+                    if args and source and source.split('!')[0].lower() == self.config.connection.nick.lower():
+                        await self.identity.who(args[0])
+
+                case 'PART':
+                    self.identity.on_part(source, args)
+
+                case 'KICK':
+                    self.identity.on_kick(args)
+
+                case 'ACCOUNT':
+                    self.identity.on_account(source, args)
+
+                case 'NICK':
+                    self.identity.on_nick(source, args)
+
+                case 'QUIT':
+                    self.identity.on_quit(source)
+
+                case '005':  # RPL_ISUPPORT
+                    self.identity.on_isupport(args)
+
+                case '354':  # RPL_WHOSPCRPL
+                    self.identity.on_whox(args)
+
+                case '315':  # RPL_ENDOFWHO
+                    self.identity.on_end_of_who(args)
+
                 case 'AUTHENTICATE':
                     await handle_authenticate(args, self.config, self.ircsend)
                     
@@ -402,22 +766,19 @@ class Bot:
                     if len(args) >= 2:
                         channel = args[1]
                         await self.ircsend(f'JOIN {channel}')
-                        self.channel_manager.save_channel(channel)
+                        if not self.channel_manager.save_channel(channel):
+                            self.logger.warning(f'Database unavailable, {channel} was not saved')
                         self.logger.info(f'Auto-joined channel {channel} after invite')
                         
                 case 'VERSION':
                     source_nick = source.split('!')[0] if source else 'unknown'
-                    await self.ircsend(f'NOTICE {source_nick} :EliteBot v{self.config.get("VERSION", "1.0.0")}')
+                    await self.ircsend(f'NOTICE {source_nick} :EliteBot v{self.config.version}')
                     
                 case '001':  # RPL_WELCOME - successful connection
                     self.logger.info('Successfully registered with IRC server')
-                    # Auto-join channels
-                    for channel in self.channel_manager.get_channels():
-                        try:
-                            await self.ircsend(f'JOIN {channel[1]}')
-                            self.logger.info(f'Auto-joined channel: {channel[1]}')
-                        except Exception as e:
-                            self.logger.error(f'Error joining channel {channel[1]}: {e}')
+                    self.profiler.mark('registered')
+                    self.caps.registered()
+                    self.spawn(self.autojoin())
                             
                 case '903':  # RPL_SASLSUCCESS
                     await handle_903(self.ircsend)
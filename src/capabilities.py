@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import asyncio
+import itertools
+
+from src.sasl import handle_sasl
+
+DEFAULT_CAPABILITIES = [
+    'cap-notify',
+    'server-time',
+    'message-tags',
+    'batch',
+    'account-tag',
+    'account-notify',
+    'extended-join',
+    'multi-prefix',
+    'away-notify',
+    'labeled-response',
+]
+MAX_REQ_LENGTH = 400
+
+
+class CapabilityManager:
+    """
+    Negotiates IRCv3 capabilities and tracks which ones are enabled.
+
+    Registration is held open with CAP LS 302 until every requested
+    capability has been ACKed or NAKed (and SASL has finished, if used).
+    Capabilities announced later through cap-notify are requested at
+    runtime. With labeled-response enabled, request() sends a command and
+    returns the server's reply to that exact command.
+    """
+
+    def __init__(self, bot, wanted=None):
+        """
+        :param bot: Reference to the main bot instance
+        :param wanted: Capabilities to request when the server offers them
+        """
+        self.bot = bot
+        self.wanted = set(DEFAULT_CAPABILITIES if wanted is None else wanted)
+        self.labels = itertools.count(1)
+        self.responses = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all negotiated state, e.g. before reconnecting.
+        """
+        self.available = {}
+        self.enabled = set()
+        self.pending = set()
+        self.ls_buffer = {}
+        self.negotiating = False
+        self.sasl_started = False
+        for future, _ in self.responses.values():
+            if not future.done():
+                future.cancel()
+        self.responses = {}
+        self.batches = {}
+
+    def has(self, cap):
+        """
+        Return True if the capability is currently enabled.
+        """
+        return cap in self.enabled
+
+    @staticmethod
+    def parse_caps(text):
+        caps = {}
+        for item in text.split():
+            name, _, value = item.partition('=')
+            caps[name] = value
+        return caps
+
+    async def start(self):
+        """
+        Begin negotiation. Must be sent before NICK and USER.
+        """
+        self.reset()
+        self.negotiating = True
+        await self.bot.ircsend('CAP LS 302')
+
+    async def handle(self, args):
+        """
+        Handle a CAP message from the server.
+
+        :param args: Parsed arguments of the CAP message, starting with the target
+        """
+        if len(args) < 3:
+            return
+        subcommand = args[1].upper()
+        # Multi-line replies put a * before the final parameter
+        more = len(args) >= 4 and args[2] == '*'
+        caps = self.parse_caps(args[-1])
+
+        match subcommand:
+            case 'LS':
+                self.ls_buffer.update(caps)
+                if not more:
+                    self.available = self.ls_buffer
+                    self.ls_buffer = {}
+                    self.bot.logger.info(f'Server capabilities: {", ".join(sorted(self.available))}')
+                    await self.request_caps(self.available)
+            case 'NEW':
+                self.available.update(caps)
+                await self.request_caps(caps)
+            case 'DEL':
+                for cap in caps:
+                    self.available.pop(cap, None)
+                    self.enabled.discard(cap)
+                self.bot.logger.info(f'Capabilities removed by server: {", ".join(caps)}')
+            case 'ACK':
+                for cap in caps:
+                    if cap.startswith('-'):
+                        self.enabled.discard(cap[1:])
+                    else:
+                        self.enabled.add(cap)
+                    self.pending.discard(cap.lstrip('-'))
+                self.bot.logger.info(f'Enabled capabilities: {", ".join(sorted(self.enabled))}')
+                await self.finish()
+            case 'NAK':
+                for cap in caps:
+                    self.pending.discard(cap)
+                self.bot.logger.warning(f'Capabilities rejected by server: {", ".join(caps)}')
+                await self.finish()
+
+    def wanted_caps(self, offered):
+        wanted = set(self.wanted)
+        if self.bot.config.sasl.use_sasl:
+            wanted.add('sasl')
+        return sorted((wanted & set(offered)) - self.enabled - self.pending)
+
+    async def request_caps(self, offered):
+        caps = self.wanted_caps(offered)
+        if not caps:
+            await self.finish()
+            return
+
+        # Keep each REQ line well below the 512 byte limit
+        line = []
+        for cap in caps:
+            if line and len(' '.join(line + [cap])) > MAX_REQ_LENGTH:
+                await self.bot.ircsend(f'CAP REQ :{" ".join(line)}')
+                line = []
+            line.append(cap)
+            self.pending.add(cap)
+        await self.bot.ircsend(f'CAP REQ :{" ".join(line)}')
+
+    async def sync(self):
+        """
+        Request or drop capabilities at runtime after the wanted set changed.
+        """
+        # cap-notify is always on with CAP LS 302 and sasl is only used at registration
+        unwanted = sorted(self.enabled - self.wanted - {'cap-notify', 'sasl'})
+        if unwanted:
+            await self.bot.ircsend(f'CAP REQ :{" ".join("-" + cap for cap in unwanted)}')
+        await self.request_caps(self.available)
+
+    async def finish(self):
+        """
+        End negotiation once no requests are outstanding, authenticating first
+        when SASL was acknowledged. A successful or failed SASL exchange sends
+        CAP END itself.
+        """
+        if not self.negotiating or self.pending:
+            return
+        if 'sasl' in self.enabled and self.bot.config.sasl.use_sasl:
+            if not self.sasl_started:
+                self.sasl_started = True
+                await handle_sasl(self.bot.config, self.bot.ircsend)
+            return
+        self.negotiating = False
+        await self.bot.ircsend('CAP END')
+
+    def registered(self):
+        """
+        Called on RPL_WELCOME, negotiation is over from then on.
+        """
+        self.negotiating = False
+
+    async def request(self, command, timeout=30):
+        """
+        Send a command with a label and wait for the labeled response.
+
+        Replies are routed before the bot's startup buffer, so this also works
+        while plugins are still loading. They are still buffered and replayed
+        to the normal handlers afterwards.
+
+        :param command: Raw IRC command to send
+        :param timeout: Seconds to wait for the response
+        :return: List of (tags, source, command, args) tuples the server sent
+                 in reply, empty if it only acknowledged the command
+        """
+        if not self.has('labeled-response'):
+            raise RuntimeError('labeled-response capability is not enabled')
+
+        label = str(next(self.labels))
+        future = asyncio.get_running_loop().create_future()
+        self.responses[label] = (future, [])
+        try:
+            await self.bot.ircsend(f'@label={label} {command}')
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.responses.pop(label, None)
+            for ref in [ref for ref, owner in self.batches.items() if owner == label]:
+                del self.batches[ref]
+
+    def handle_tags(self, tags, source, command, args):
+        """
+        Route a tagged message to a waiting request(), if it belongs to one.
+        """
+        label = tags.get('label')
+        if label is None and 'batch' in tags:
+            label = self.batches.get(tags['batch'])
+        if label is None and command == 'BATCH' and args and args[0].startswith('-'):
+            label = self.batches.get(args[0][1:])
+        if label not in self.responses:
+            return
+
+        future, lines = self.responses[label]
+        if command == 'BATCH' and args:
+            ref = args[0][1:]
+            if args[0].startswith('+'):
+                self.batches[ref] = label
+            else:
+                self.batches.pop(ref, None)
+                if label not in self.batches.values() and not future.done():
+                    future.set_result(lines)
+            return
+
+        if command != 'ACK':
+            lines.append((tags, source, command, args))
+        if 'batch' not in tags and not future.done():
+            future.set_result(lines)
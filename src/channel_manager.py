@@ -1,30 +1,53 @@
 #!/usr/bin/env python3
 
-from src.db import Database
-from sqlalchemy import Table, Column, Integer, String, Boolean, MetaData
-
-meta = MetaData()
-channel_table = Table(
-    'Channels',
-    meta,
-    Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('channel', String, unique=True, nullable=False),
-    Column('autojoin', Boolean, default=True),
-)
-db = Database(channel_table, meta)
-
 
 class ChannelManager:
     def __init__(self):
-        db.create_table(channel_table.name)
-
-        self.channels = db._load_channels()
+        self.db = None
+        self.channels = []
+
+    def load(self):
+        """
+        Open the database, create the table if needed and load saved channels.
+        This imports SQLAlchemy and blocks, so the bot runs it in a worker thread.
+        """
+        from sqlalchemy import Table, Column, Integer, String, Boolean, MetaData
+        from src.db import Database
+
+        meta = MetaData()
+        channel_table = Table(
+            'Channels',
+            meta,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('channel', String, unique=True, nullable=False),
+            Column('autojoin', Boolean, default=True),
+        )
+        self.db = Database(channel_table, meta)
+        self.db.create_table(channel_table.name)
+
+        self.channels = self.db._load_channels()
 
     def save_channel(self, channel):
-        db._save_channel(channel)
+        """
+        Save channel for autojoin.
+
+        :return: False if the database is unavailable, e.g. it failed to load
+        """
+        if self.db is None:
+            return False
+        self.db._save_channel(channel)
+        return True
 
     def remove_channel(self, channel):
-        db._remove_channel(channel)
+        """
+        Remove channel from autojoin.
+
+        :return: False if the database is unavailable, e.g. it failed to load
+        """
+        if self.db is None:
+            return False
+        self.db._remove_channel(channel)
+        return True
 
     def get_channels(self):
         return self.channels
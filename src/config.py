@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from dataclasses import dataclass, field, fields, replace
+
+from src.capabilities import DEFAULT_CAPABILITIES
+
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+TYPE_NAMES = {str: 'string', int: 'integer', float: 'number', bool: 'boolean', list: 'list', dict: 'mapping'}
+REQUIRED = object()
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def config_path(path, key=None):
+    return ' -> '.join(path + [key] if key is not None else path)
+
+
+def read_section(data, path, key):
+    value = data.get(key)
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ConfigError(f'Invalid config field {config_path(path, key)}: expected mapping, '
+                          f'got {type(value).__name__}')
+    return value
+
+
+def read_field(data, path, key, kind, default=REQUIRED, check=None, message=None):
+    """
+    Read and type-check one config value.
+
+    :param data: Mapping the value lives in
+    :param path: Keys leading to data, used in error messages
+    :param key: Key of the value
+    :param kind: Expected Python type
+    :param default: Value used when the key is missing, required if not given
+    :param check: Optional predicate the value must satisfy
+    :param message: Error message used when check fails
+    """
+    value = data.get(key)
+    if value is None or value == '':
+        if default is REQUIRED:
+            raise ConfigError(f'Missing required config field: {config_path(path, key)}')
+        return default
+
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    if not isinstance(value, kind) or (isinstance(value, bool) and kind is not bool):
+        raise ConfigError(f'Invalid config field {config_path(path, key)}: expected {TYPE_NAMES[kind]}, '
+                          f'got {type(value).__name__}')
+    if check is not None and not check(value):
+        raise ConfigError(f'Invalid config field {config_path(path, key)}: {message}')
+    return value
+
+
+def read_string_list(data, path, key, default):
+    values = read_field(data, path, key, list, default)
+    for i, value in enumerate(values):
+        if not isinstance(value, str):
+            raise ConfigError(f'Invalid config field {config_path(path, key)} -> {i}: expected string, '
+                              f'got {type(value).__name__}')
+    return tuple(values)
+
+
+def read_roles(data, path, key):
+    roles = read_field(data, path, key, dict, {})
+    result = {}
+    for name, values in roles.items():
+        entry_path = path + [key]
+        if isinstance(values, str):
+            values = [values]
+        result[str(name)] = read_string_list({name: values}, entry_path, name, [])
+    return result
+
+
+def positive(value):
+    return value > 0
+
+
+@dataclass(slots=True)
+class ConnectionConfig:
+    hostname: str
+    port: int
+    tls: bool
+    nick: str
+    ident: str
+    name: str
+    bind_host: str | None = None
+
+    @classmethod
+    def from_dict(cls, data, path):
+        port = data.get('Port')
+        tls = isinstance(port, str) and port.startswith('+')
+        if isinstance(port, str):
+            port = port[1:] if tls else port
+            if not port.isdigit():
+                raise ConfigError(f'Invalid config field {config_path(path, "Port")}: expected a port number, '
+                                  f'optionally prefixed with + for TLS')
+            port = int(port)
+        port = read_field({'Port': port}, path, 'Port', int, check=lambda p: 0 < p < 65536,
+                          message='expected a port number between 1 and 65535')
+        return cls(
+            hostname=read_field(data, path, 'Hostname', str),
+            port=port,
+            tls=tls,
+            nick=read_field(data, path, 'Nick', str),
+            ident=read_field(data, path, 'Ident', str),
+            name=read_field(data, path, 'Name', str),
+            bind_host=read_field(data, path, 'BindHost', str, None),
+        )
+
+
+@dataclass(slots=True)
+class SASLConfig:
+    use_sasl: bool = False
+    nick: str = ''
+    password: str = ''
+
+    @classmethod
+    def from_dict(cls, data, path):
+        use_sasl = read_field(data, path, 'UseSASL', bool, False)
+        required = REQUIRED if use_sasl else ''
+        return cls(
+            use_sasl=use_sasl,
+            nick=read_field(data, path, 'SASLNick', str, required),
+            password=read_field(data, path, 'SASLPassword', str, required),
+        )
+
+
+@dataclass(slots=True)
+class DatabaseConfig:
+    connection_string: str
+
+    @classmethod
+    def from_dict(cls, data, path):
+        return cls(connection_string=read_field(data, path, 'ConnectionString', str))
+
+
+@dataclass(slots=True)
+class LoggingConfig:
+    console: bool = True
+    level: str = 'debug'
+
+    @classmethod
+    def from_dict(cls, data, path):
+        return cls(
+            console=read_field(data, path, 'Console', bool, True),
+            level=read_field(data, path, 'Level', str, 'debug', lambda l: l.lower() in LOG_LEVELS,
+                             f'expected one of {", ".join(LOG_LEVELS)}').lower(),
+        )
+
+
+@dataclass(slots=True)
+class HistoryConfig:
+    max_lines_per_channel: int = 1000
+    max_memory_mb: float = 64.0
+
+    @classmethod
+    def from_dict(cls, data, path):
+        return cls(
+            max_lines_per_channel=read_field(data, path, 'MaxLinesPerChannel', int, 1000, positive,
+                                             'must be greater than 0'),
+            max_memory_mb=read_field(data, path, 'MaxMemoryMB', float, 64.0, positive, 'must be greater than 0'),
+        )
+
+
+@dataclass(slots=True)
+class ArchiveConfig:
+    enabled: bool = False
+    directory: str = 'data/archive'
+    network: str | None = None
+    segment_size_mb: float = 64.0
+    block_lines: int = 256
+    flush_seconds: float = 5.0
+    max_open_segments: int = 64
+
+    @classmethod
+    def from_dict(cls, data, path):
+        return cls(
+            enabled=read_field(data, path, 'Enabled', bool, False),
+            directory=read_field(data, path, 'Directory', str, 'data/archive'),
+            network=read_field(data, path, 'Network', str, None),
+            segment_size_mb=read_field(data, path, 'SegmentSizeMB', float, 64.0, positive, 'must be greater than 0'),
+            block_lines=read_field(data, path, 'BlockLines', int, 256, positive, 'must be greater than 0'),
+            flush_seconds=read_field(data, path, 'FlushSeconds', float, 5.0, positive, 'must be greater than 0'),
+            max_open_segments=read_field(data, path, 'MaxOpenSegments', int, 64, positive,
+                                         'must be greater than 0'),
+        )
+
+
+@dataclass(slots=True)
+class IdentityConfig:
+    max_entries: int = 10000
+
+    @classmethod
+    def from_dict(cls, data, path):
+        return cls(max_entries=read_field(data, path, 'MaxEntries', int, 10000, positive, 'must be greater than 0'))
+
+
+@dataclass(slots=True)
+class PermissionsConfig:
+    accounts: dict = field(default_factory=dict)
+    masks: dict = field(default_factory=dict)
+    commands: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data, path):
+        commands = read_field(data, path, 'Commands', dict, {})
+        for cmd, role in commands.items():
+            read_field(commands, path + ['Commands'], cmd, str)
+        return cls(
+            accounts=read_roles(data, path, 'Accounts'),
+            masks=read_roles(data, path, 'Masks'),
+            commands={str(cmd).lower(): role for cmd, role in commands.items()},
+        )
+
+
+@dataclass(slots=True)
+class Config:
+    """
+    Validated bot configuration, built once from the JSON or YAML file.
+
+    Sections the bot uses are typed attributes. Plugins can still read their
+    own top-level sections with config['Section'] or config.get('Section').
+    """
+    version: str
+    connection: ConnectionConfig
+    sasl: SASLConfig
+    database: DatabaseConfig
+    logging: LoggingConfig
+    history: HistoryConfig
+    archive: ArchiveConfig
+    identity: IdentityConfig
+    permissions: PermissionsConfig
+    capabilities: tuple
+    channels: tuple
+    plugins: dict
+    raw: dict
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ConfigError(f'Invalid config: expected a mapping at the top level, got {type(data).__name__}')
+        version = data.get('VERSION', '1.0.0')
+        return cls(
+            version=str(version),
+            connection=ConnectionConfig.from_dict(read_section(data, [], 'Connection'), ['Connection']),
+            sasl=SASLConfig.from_dict(read_section(data, [], 'SASL'), ['SASL']),
+            database=DatabaseConfig.from_dict(read_section(data, [], 'Database'), ['Database']),
+            logging=LoggingConfig.from_dict(read_section(data, [], 'Logging'), ['Logging']),
+            history=HistoryConfig.from_dict(read_section(data, [], 'History'), ['History']),
+            archive=ArchiveConfig.from_dict(read_section(data, [], 'Archive'), ['Archive']),
+            identity=IdentityConfig.from_dict(read_section(data, [], 'Identity'), ['Identity']),
+            permissions=PermissionsConfig.from_dict(read_section(data, [], 'Permissions'), ['Permissions']),
+            capabilities=read_string_list(data, [], 'Capabilities', DEFAULT_CAPABILITIES),
+            channels=read_string_list(data, [], 'Channels', []),
+            plugins=read_section(data, [], 'Plugins'),
+            raw=data,
+        )
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def get(self, key, default=None):
+        return self.raw.get(key, default)
+
+
+# Changes to these sections only take effect after reconnecting, or after restarting the bot
+RECONNECT_SECTIONS = ('connection', 'sasl')
+RESTART_SECTIONS = ('database', 'archive')
+SECTION_NAMES = {
+    'version': 'VERSION', 'connection': 'Connection', 'sasl': 'SASL', 'database': 'Database',
+    'logging': 'Logging', 'history': 'History', 'archive': 'Archive', 'identity': 'Identity',
+    'permissions': 'Permissions', 'capabilities': 'Capabilities', 'channels': 'Channels', 'plugins': 'Plugins',
+}
+# Config keys of the fields in sections that are not applied on reload
+FIELD_KEYS = {
+    'connection': {'hostname': 'Hostname', 'port': 'Port', 'tls': 'Port', 'nick': 'Nick', 'ident': 'Ident',
+                   'name': 'Name', 'bind_host': 'BindHost'},
+    'sasl': {'use_sasl': 'UseSASL', 'nick': 'SASLNick', 'password': 'SASLPassword'},
+    'database': {'connection_string': 'ConnectionString'},
+    'archive': {'enabled': 'Enabled', 'directory': 'Directory', 'network': 'Network',
+                'segment_size_mb': 'SegmentSizeMB', 'block_lines': 'BlockLines', 'flush_seconds': 'FlushSeconds',
+                'max_open_segments': 'MaxOpenSegments'},
+}
+
+
+def changed_fields(section, old_value, new_value):
+    paths = []
+    for item in fields(old_value):
+        if getattr(old_value, item.name) != getattr(new_value, item.name):
+            path = config_path([SECTION_NAMES[section]], FIELD_KEYS[section][item.name])
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def diff_config(old, new):
+    """
+    Compare two configs.
+
+    :return: Tuple of (changed section attribute names, changed fields that need a
+             reconnect, changed fields that need a restart), fields as config key paths
+    """
+    changed = []
+    reconnect = []
+    restart = []
+    for section in SECTION_NAMES:
+        old_value, new_value = getattr(old, section), getattr(new, section)
+        if old_value == new_value:
+            continue
+        changed.append(section)
+        if section in RECONNECT_SECTIONS:
+            reconnect += changed_fields(section, old_value, new_value)
+        elif section in RESTART_SECTIONS:
+            restart += changed_fields(section, old_value, new_value)
+    return changed, reconnect, restart
+
+
+def with_sections(config, source, sections):
+    """
+    Return a copy of config with the given sections taken from source.
+    """
+    return replace(config, **{section: getattr(source, section) for section in sections})
+
+
+def load_config(config_file):
+    """
+    Read, parse and validate a JSON or YAML config file.
+
+    :raises FileNotFoundError: If the file does not exist
+    :raises ConfigError: If the file can't be parsed or fails validation
+    """
+    _, ext = os.path.splitext(config_file)
+    with open(config_file, 'r') as file:
+        if ext == '.json':
+            try:
+                data = json.load(file)
+            except json.JSONDecodeError as e:
+                raise ConfigError(f'Error parsing config file {config_file}: {e}') from e
+        elif ext == '.yaml' or ext == '.yml':
+            # PyYAML is only imported when a YAML config is actually used
+            import yaml
+            try:
+                data = yaml.safe_load(file)
+            except yaml.YAMLError as e:
+                raise ConfigError(f'Error parsing config file {config_file}: {e}') from e
+        else:
+            raise ConfigError(f'Unsupported file extension: {ext}')
+    return Config.from_dict(data)
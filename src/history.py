@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from typing import NamedTuple
+
+KINDS = ('PRIVMSG', 'NOTICE', 'ACTION')
+TOKEN_RE = re.compile(r'\w{3,}')
+
+# timestamp (d) + nick id (I) + kind (B) + previous line by nick (q) + text slot
+LINE_OVERHEAD = 8 + 4 + 1 + 8 + 8
+POSTING_SIZE = 8
+# Average cost of one dict entry, including the free slots of a dict that grows by doubling
+DICT_ENTRY_OVERHEAD = 50
+# A token key of a buffer's word index: its dict entry and posting array, the key text is added
+TOKEN_OVERHEAD = DICT_ENTRY_OVERHEAD + sys.getsizeof(array('q'))
+# A last_by_nick entry: its dict entry and the sequence number it points to
+LAST_BY_NICK_OVERHEAD = DICT_ENTRY_OVERHEAD + sys.getsizeof(2 ** 40)
+# A live nick: its id mapping plus its nicks and refs slots, the nick and lowercased key are added
+NICK_OVERHEAD = DICT_ENTRY_OVERHEAD + 8 + 4
+
+
+def tokenize(text):
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+class HistoryEntry(NamedTuple):
+    timestamp: float
+    channel: str
+    nick: str
+    kind: str
+    text: str
+
+
+class NickTable:
+    """
+    Interns nicks into small integer ids shared by every channel buffer.
+    Ids are reference counted and recycled once no stored line uses them.
+    ``bytes`` is the approximate footprint of the live nicks.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.nicks = []
+        self.refs = array('I')
+        self.free = []
+        self.bytes = 0
+
+    def acquire(self, nick):
+        key = nick.lower()
+        nick_id = self.ids.get(key)
+        if nick_id is None:
+            nick = sys.intern(nick)
+            if self.free:
+                nick_id = self.free.pop()
+                self.nicks[nick_id] = nick
+                self.refs[nick_id] = 0
+            else:
+                nick_id = len(self.nicks)
+                self.nicks.append(nick)
+                self.refs.append(0)
+            self.ids[key] = nick_id
+            self.bytes += NICK_OVERHEAD + sys.getsizeof(nick) + sys.getsizeof(key)
+        self.refs[nick_id] += 1
+        return nick_id
+
+    def release(self, nick_id):
+        self.refs[nick_id] -= 1
+        if self.refs[nick_id] == 0:
+            nick = self.nicks[nick_id]
+            key = nick.lower()
+            del self.ids[key]
+            self.bytes -= NICK_OVERHEAD + sys.getsizeof(nick) + sys.getsizeof(key)
+            self.nicks[nick_id] = None
+            self.free.append(nick_id)
+
+    def lookup(self, nick):
+        return self.ids.get(nick.lower())
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class ChannelBuffer:
+    """
+    Ring buffer of the most recent lines of one channel.
+
+    Every line gets a sequence number; the live window is [start, end) and a
+    line lives in slot ``seq % capacity``. Columns are stored in packed arrays
+    so a line costs a few bytes plus its text.
+
+    Posting lists of the word index may start with sequence numbers that were
+    already evicted; that dead prefix is dropped once it outweighs the live
+    part, so evicting a line never shifts a whole list. ``bytes`` is the
+    approximate footprint of the buffer, its lines and its indexes.
+    """
+
+    __slots__ = ('name', 'capacity', 'start', 'end', 'timestamps', 'nick_ids', 'kinds',
+                 'prev_by_nick', 'texts', 'last_by_nick', 'tokens', 'bytes')
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.start = 0
+        self.end = 0
+        self.timestamps = array('d')
+        self.nick_ids = array('I')
+        self.kinds = array('B')
+        self.prev_by_nick = array('q')
+        self.texts = []
+        self.last_by_nick = {}
+        self.tokens = {}
+        # The buffer and its containers, its entry in MessageHistory.channels and the name and key
+        self.bytes = (sys.getsizeof(self) + 4 * sys.getsizeof(self.timestamps) + sys.getsizeof(self.texts)
+                      + 2 * sys.getsizeof(self.tokens) + DICT_ENTRY_OVERHEAD + 2 * sys.getsizeof(name))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def oldest_timestamp(self):
+        return self.timestamps[self.start % self.capacity]
+
+    def append(self, timestamp, nick_id, kind, text, tokens):
+        seq = self.end
+        slot = seq % self.capacity
+        if self.end > self.start:
+            timestamp = max(timestamp, self.timestamps[(seq - 1) % self.capacity])
+        prev = self.last_by_nick.get(nick_id, -1)
+
+        if slot == len(self.texts):
+            self.timestamps.append(timestamp)
+            self.nick_ids.append(nick_id)
+            self.kinds.append(kind)
+            self.prev_by_nick.append(prev)
+            self.texts.append(text)
+        else:
+            self.timestamps[slot] = timestamp
+            self.nick_ids[slot] = nick_id
+            self.kinds[slot] = kind
+            self.prev_by_nick[slot] = prev
+            self.texts[slot] = text
+
+        self.bytes += LINE_OVERHEAD + sys.getsizeof(text)
+        if nick_id not in self.last_by_nick:
+            self.bytes += LAST_BY_NICK_OVERHEAD
+        self.last_by_nick[nick_id] = seq
+        for token in tokens:
+            seqs = self.tokens.get(token)
+            if seqs is None:
+                self.tokens[token] = array('q', (seq,))
+                self.bytes += TOKEN_OVERHEAD + sys.getsizeof(token) + POSTING_SIZE
+            else:
+                seqs.append(seq)
+                self.bytes += POSTING_SIZE
+        self.end += 1
+
+    def evict(self):
+        """
+        Drop the oldest line and return its nick id and text.
+        """
+        seq = self.start
+        slot = seq % self.capacity
+        nick_id = self.nick_ids[slot]
+        text = self.texts[slot]
+        self.texts[slot] = None
+        self.start += 1
+        self.bytes -= LINE_OVERHEAD + sys.getsizeof(text)
+
+        if self.last_by_nick.get(nick_id) == seq:
+            del self.last_by_nick[nick_id]
+            self.bytes -= LAST_BY_NICK_OVERHEAD
+        for token in tokenize(text):
+            seqs = self.tokens[token]
+            if seqs[-1] < self.start:
+                del self.tokens[token]
+                self.bytes -= TOKEN_OVERHEAD + sys.getsizeof(token) + POSTING_SIZE * len(seqs)
+                continue
+            dead = bisect_left(seqs, self.start)
+            if dead * 2 > len(seqs):
+                del seqs[:dead]
+                self.bytes -= POSTING_SIZE * dead
+        return nick_id, text
+
+    def resize(self, capacity):
+        """
+        Change the capacity, renumbering the live lines from 0 so slots stay
+        contiguous. The caller must evict down to capacity first.
+        """
+        offset = self.start
+        order = [seq % self.capacity for seq in range(self.start, self.end)]
+        self.timestamps = array('d', (self.timestamps[slot] for slot in order))
+        self.nick_ids = array('I', (self.nick_ids[slot] for slot in order))
+        self.kinds = array('B', (self.kinds[slot] for slot in order))
+        self.prev_by_nick = array('q', (self.prev_by_nick[slot] - offset if self.prev_by_nick[slot] >= offset
+                                        else -1 for slot in order))
+        self.texts = [self.texts[slot] for slot in order]
+        self.last_by_nick = {nick_id: seq - offset for nick_id, seq in self.last_by_nick.items()}
+        for token, seqs in self.tokens.items():
+            dead = bisect_left(seqs, offset)
+            self.tokens[token] = array('q', (seqs[i] - offset for i in range(dead, len(seqs))))
+            self.bytes -= POSTING_SIZE * dead
+        self.capacity = capacity
+        self.start = 0
+        self.end -= offset
+
+    def find_seq(self, timestamp, after=False):
+        """
+        Return the first live sequence number whose timestamp is >= timestamp,
+        or > timestamp when after is set.
+        """
+        lo, hi = self.start, self.end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.timestamps[mid % self.capacity]
+            if value < timestamp or (after and value == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class MessageHistory:
+    """
+    Shared, memory-bounded history of PRIVMSG, NOTICE and ACTION lines.
+
+    Each channel keeps a ring buffer of at most ``max_lines_per_channel``
+    lines. Across all channels the approximate footprint, lines and indexes
+    included, is capped at ``max_bytes``; when it is exceeded the globally
+    oldest lines are evicted. A heap holds one entry per non-empty buffer,
+    keyed by its oldest line. Entries go stale when a buffer drops lines on
+    its own and are only refreshed when they reach the top.
+    """
+
+    def __init__(self, max_lines_per_channel=1000, max_bytes=64 * 1024 * 1024):
+        self.max_lines_per_channel = max_lines_per_channel
+        self.max_bytes = max_bytes
+        self.nicks = NickTable()
+        self.channels = {}
+        self.oldest = []
+        self.counter = itertools.count()
+        self.total_bytes = 0
+        self.total_lines = 0
+
+    def set_limits(self, max_lines_per_channel, max_bytes):
+        """
+        Change the limits, resizing existing channel buffers and evicting
+        their oldest lines where they no longer fit.
+        """
+        self.max_lines_per_channel = max_lines_per_channel
+        self.max_bytes = max_bytes
+        for buffer in self.channels.values():
+            if buffer.capacity == max_lines_per_channel:
+                continue
+            while len(buffer) > max_lines_per_channel:
+                self._evict(buffer)
+            before = buffer.bytes
+            buffer.resize(max_lines_per_channel)
+            self.total_bytes += buffer.bytes - before
+        # Sequence numbers were renumbered, so the heap is rebuilt
+        self.oldest = [self._heap_entry(buffer) for buffer in self.channels.values() if len(buffer)]
+        heapq.heapify(self.oldest)
+        self._trim()
+
+    def _heap_entry(self, buffer):
+        return buffer.oldest_timestamp(), buffer.start, next(self.counter), buffer
+
+    def add(self, channel, nick, text, kind='PRIVMSG', timestamp=None):
+        """
+        Store a line.
+
+        :param channel: Channel (or nick, for private messages) the line belongs to
+        :param nick: Nick of the sender
+        :param text: Message text, without CTCP framing
+        :param kind: One of PRIVMSG, NOTICE or ACTION
+        :param timestamp: Unix time of the line, defaults to now
+        """
+        key = channel.lower()
+        buffer = self.channels.get(key)
+        created = buffer is None
+        if created:
+            buffer = self.channels[key] = ChannelBuffer(channel, self.max_lines_per_channel)
+            self.total_bytes += buffer.bytes
+        if len(buffer) == buffer.capacity:
+            self._evict(buffer)
+
+        before = buffer.bytes + self.nicks.bytes
+        nick_id = self.nicks.acquire(nick)
+        buffer.append(time.time() if timestamp is None else timestamp, nick_id,
+                      KINDS.index(kind), text, tokenize(text))
+        if created:
+            heapq.heappush(self.oldest, self._heap_entry(buffer))
+        self.total_bytes += buffer.bytes + self.nicks.bytes - before
+        self.total_lines += 1
+        self._trim()
+
+    def _trim(self):
+        while self.total_bytes > self.max_bytes and self.total_lines > 1:
+            _, seq, _, buffer = self.oldest[0]
+            if seq != buffer.start:
+                # The buffer evicted lines itself since the entry was pushed
+                heapq.heapreplace(self.oldest, self._heap_entry(buffer))
+                continue
+            self._evict(buffer)
+            if len(buffer):
+                heapq.heapreplace(self.oldest, self._heap_entry(buffer))
+            else:
+                heapq.heappop(self.oldest)
+                del self.channels[buffer.name.lower()]
+                self.total_bytes -= buffer.bytes
+
+    def _evict(self, buffer):
+        before = buffer.bytes + self.nicks.bytes
+        nick_id, _ = buffer.evict()
+        self.nicks.release(nick_id)
+        self.total_bytes += buffer.bytes + self.nicks.bytes - before
+        self.total_lines -= 1
+
+    def _entry(self, buffer, seq):
+        slot = seq % buffer.capacity
+        return HistoryEntry(buffer.timestamps[slot], buffer.name,
+                            self.nicks.nicks[buffer.nick_ids[slot]],
+                            KINDS[buffer.kinds[slot]], buffer.texts[slot])
+
+    def last_by(self, channel, nick):
+        """
+        Return the most recent line sent by nick in channel, or None.
+        """
+        buffer = self.channels.get(channel.lower())
+        nick_id = self.nicks.lookup(nick)
+        if buffer is None or nick_id is None:
+            return None
+        seq = buffer.last_by_nick.get(nick_id)
+        return None if seq is None else self._entry(buffer, seq)
+
+    def last_matching(self, channel, pattern, nick=None):
+        """
+        Return the most recent line in channel matching pattern, or None.
+
+        A string pattern is a case-insensitive substring match and uses the
+        word index when it contains a complete word; a compiled regex is
+        tested newest-first. Passing nick only walks that nick's lines.
+        """
+        buffer = self.channels.get(channel.lower())
+        if buffer is None:
+            return None
+
+        if isinstance(pattern, str):
+            needle = pattern.lower()
+            matches = lambda text: needle in text.lower()
+        else:
+            matches = lambda text: pattern.search(text) is not None
+
+        if nick is not None:
+            nick_id = self.nicks.lookup(nick)
+            seq = buffer.last_by_nick.get(nick_id, -1) if nick_id is not None else -1
+            while seq >= buffer.start:
+                slot = seq % buffer.capacity
+                if matches(buffer.texts[slot]):
+                    return self._entry(buffer, seq)
+                seq = buffer.prev_by_nick[slot]
+            return None
+
+        candidates = None
+        if isinstance(pattern, str):
+            # Only words bounded on both sides inside the needle are guaranteed
+            # to be whole tokens of a matching line.
+            for match in TOKEN_RE.finditer(needle):
+                if match.start() > 0 and match.end() < len(needle):
+                    seqs = buffer.tokens.get(match.group())
+                    if seqs is None:
+                        return None
+                    if candidates is None or len(seqs) < len(candidates):
+                        candidates = seqs
+
+        seqs = reversed(candidates) if candidates is not None else range(buffer.end - 1, buffer.start - 1, -1)
+        for seq in seqs:
+            if seq < buffer.start:
+                # Dead prefix of a posting list
+                break
+            if matches(buffer.texts[seq % buffer.capacity]):
+                return self._entry(buffer, seq)
+        return None
+
+    def between(self, channel, since, until=None):
+        """
+        Return the lines of channel with since <= timestamp <= until, oldest first.
+        """
+        buffer = self.channels.get(channel.lower())
+        if buffer is None:
+            return []
+        first = buffer.find_seq(since)
+        last = buffer.end if until is None else buffer.find_seq(until, after=True)
+        return [self._entry(buffer, seq) for seq in range(first, last)]
+
+    def recent(self, channel, limit=10):
+        """
+        Return up to limit of the newest lines of channel, oldest first.
+        """
+        buffer = self.channels.get(channel.lower())
+        if buffer is None:
+            return []
+        first = max(buffer.start, buffer.end - limit)
+        return [self._entry(buffer, seq) for seq in range(first, buffer.end)]
+
+    def memory_usage(self):
+        """
+        Return the approximate number of bytes held by stored lines and indexes.
+        """
+        return self.total_bytes
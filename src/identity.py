@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+import asyncio
+from collections import OrderedDict
+
+WHOX_TOKEN = '152'
+WHOX_FIELDS = f'%tcuhna,{WHOX_TOKEN}'
+
+# RFC 1459 casemapping, the IRC default: []\~ are the uppercase of {}|^
+IRC_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~', 'abcdefghijklmnopqrstuvwxyz{}|^')
+
+
+def irc_lower(text):
+    return text.translate(IRC_LOWER)
+
+
+class Identity:
+    """
+    What the bot knows about a nick. account is None when unknown and ''
+    when the user is known to be logged out. channels holds the channels
+    the bot has seen the user in.
+    """
+
+    __slots__ = ('nick', 'user', 'host', 'account', 'channels')
+
+    def __init__(self, nick, user=None, host=None, account=None):
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.account = account
+        self.channels = set()
+
+    @property
+    def hostmask(self):
+        return f'{self.nick}!{self.user or "*"}@{self.host or "*"}'
+
+    def __repr__(self):
+        return f'Identity({self.hostmask}, account={self.account!r})'
+
+
+class IdentityService:
+    """
+    Bounded nick -> account/hostmask cache.
+
+    Entries are filled passively from message sources, account-tag,
+    extended-join, account-notify and WHOX replies. They are kept consistent
+    on NICK, and dropped on QUIT or when a PART/KICK leaves no shared
+    channel. resolve() only queries the server (with WHOX) when the account
+    is unknown. Lookups made in the same event loop iteration are sent
+    together, as one WHO per nick unless the server's TARGMAX allows several
+    targets per WHO.
+    """
+
+    def __init__(self, bot, max_entries=10000, timeout=10):
+        """
+        :param bot: Reference to the main bot instance
+        :param max_entries: Number of nicks to keep, least recently seen are dropped first
+        :param timeout: Seconds to wait for a WHOX reply
+        """
+        self.bot = bot
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.whox = False
+        self.who_targets = 1
+        self.waiting = {}
+        self.queued = []
+        self.flush_task = None
+
+    def reset(self):
+        """
+        Drop everything, e.g. before reconnecting.
+        """
+        self.entries.clear()
+        self.whox = False
+        self.who_targets = 1
+        for future in self.waiting.values():
+            if not future.done():
+                future.cancel()
+        self.waiting = {}
+        self.queued = []
+
+    def set_max_entries(self, max_entries):
+        self.max_entries = max_entries
+        self.trim()
+
+    def trim(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, nick):
+        """
+        Return the cached Identity for nick, or None.
+        """
+        return self.entries.get(irc_lower(nick))
+
+    def update(self, nick, user=None, host=None, account=None, channel=None):
+        key = irc_lower(nick)
+        identity = self.entries.get(key)
+        if identity is None:
+            identity = self.entries[key] = Identity(nick, user, host, account)
+            self.trim()
+        else:
+            self.entries.move_to_end(key)
+            identity.nick = nick
+            # A different user@host may be someone else using the nick
+            if (user is not None and user != identity.user) or (host is not None and host != identity.host):
+                identity.account = None
+                identity.channels.clear()
+            if user is not None:
+                identity.user = user
+            if host is not None:
+                identity.host = host
+            if account is not None:
+                identity.account = account
+        if channel is not None:
+            identity.channels.add(irc_lower(channel))
+        return identity
+
+    def observe(self, source, tags):
+        """
+        Update the cache from the source and tags of any message.
+        """
+        if not source or '!' not in source:
+            return
+        nick, _, userhost = source.partition('!')
+        user, _, host = userhost.partition('@')
+        account = None
+        if 'account' in tags:
+            account = tags['account']
+        elif self.bot.caps.has('account-tag'):
+            # With account-tag, a missing tag means the user is logged out
+            account = ''
+        self.update(nick, user, host, account)
+
+    def on_join(self, source, args):
+        if not args or not source or '!' not in source:
+            return
+        account = None
+        if self.bot.caps.has('extended-join') and len(args) >= 2:
+            account = '' if args[1] == '*' else args[1]
+        self.update(source.split('!')[0], account=account, channel=args[0])
+
+    def leave(self, nick, channel):
+        """
+        Forget that nick shares channel with us, dropping the entry if no
+        shared channel is left.
+        """
+        key = irc_lower(nick)
+        identity = self.entries.get(key)
+        if identity is None:
+            return
+        identity.channels.discard(irc_lower(channel))
+        if not identity.channels:
+            del self.entries[key]
+
+    def on_part(self, source, args):
+        if not args or not source:
+            return
+        nick = source.split('!')[0]
+        if irc_lower(nick) == irc_lower(self.bot.config.connection.nick):
+            self.forget_channel(args[0])
+        else:
+            self.leave(nick, args[0])
+
+    def on_kick(self, args):
+        if len(args) < 2:
+            return
+        if irc_lower(args[1]) == irc_lower(self.bot.config.connection.nick):
+            self.forget_channel(args[0])
+        else:
+            self.leave(args[1], args[0])
+
+    def forget_channel(self, channel):
+        """
+        The bot left channel: nobody is known to share it any more.
+        """
+        channel = irc_lower(channel)
+        for key in [key for key, identity in self.entries.items() if channel in identity.channels]:
+            self.entries[key].channels.discard(channel)
+            if not self.entries[key].channels:
+                del self.entries[key]
+
+    def on_account(self, source, args):
+        if args and source:
+            self.update(source.split('!')[0], account='' if args[0] == '*' else args[0])
+
+    def on_nick(self, source, args):
+        if not args or not source:
+            return
+        identity = self.entries.pop(irc_lower(source.split('!')[0]), None)
+        if identity is not None:
+            identity.nick = args[0]
+            self.entries[irc_lower(args[0])] = identity
+
+    def on_quit(self, source):
+        if source:
+            self.entries.pop(irc_lower(source.split('!')[0]), None)
+
+    def on_isupport(self, args):
+        for token in args[1:-1]:
+            if token == 'WHOX':
+                self.whox = True
+            elif token.startswith('TARGMAX='):
+                for limit in token[8:].split(','):
+                    command, _, value = limit.partition(':')
+                    if command.upper() == 'WHO':
+                        self.who_targets = int(value) if value.isdigit() else 1
+
+    def on_whox(self, args):
+        # 354 <me> <token> <channel> <user> <host> <nick> <account>
+        if len(args) >= 7 and args[1] == WHOX_TOKEN:
+            channel = args[2] if args[2][:1] in '#&' else None
+            self.update(args[5], args[3], args[4], '' if args[6] == '0' else args[6], channel)
+
+    def on_end_of_who(self, args):
+        if len(args) < 2:
+            return
+        # A batched WHO ends with the whole comma separated target list
+        for nick in args[1].split(','):
+            future = self.waiting.pop(irc_lower(nick), None)
+            if future is not None and not future.done():
+                future.set_result(self.get(nick))
+
+    async def who(self, mask):
+        """
+        Fill the cache for every user matching mask, e.g. a channel just joined.
+        """
+        if self.whox:
+            await self.bot.ircsend(f'WHO {mask} {WHOX_FIELDS}')
+
+    async def resolve(self, nick):
+        """
+        Return the Identity of nick with a known account if possible.
+
+        Cached answers are returned immediately; otherwise a WHOX query is
+        queued and sent together with any other lookups made in the same
+        event loop iteration.
+        """
+        identity = self.get(nick)
+        if (identity is not None and identity.account is not None) or not self.whox:
+            return identity
+
+        key = irc_lower(nick)
+        future = self.waiting.get(key)
+        if future is None:
+            future = self.waiting[key] = asyncio.get_running_loop().create_future()
+            self.queued.append(nick)
+            if self.flush_task is None or self.flush_task.done():
+                self.flush_task = asyncio.create_task(self.flush())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.waiting.pop(key, None)
+            return self.get(nick)
+
+    async def flush(self):
+        await asyncio.sleep(0)
+        queued, self.queued = self.queued, []
+        for i in range(0, len(queued), self.who_targets):
+            await self.bot.ircsend(f'WHO {",".join(queued[i:i + self.who_targets])} {WHOX_FIELDS}')
@@ -1,18 +1,27 @@
 import os
 from datetime import datetime
 
-import colorama
+LEVELS = {'debug': 10, 'info': 20, 'warn': 30, 'warning': 30, 'error': 40}
 
 
 class Logger:
-    def __init__(self, log_file: str, datefmt: str = '%m/%d/%Y %I:%M:%S %p'):
-        colorama.init()
+    def __init__(self, log_file: str, datefmt: str = '%m/%d/%Y %I:%M:%S %p', level: str = 'debug'):
+        # ANSI colours work natively everywhere but the Windows console
+        if os.name == 'nt':
+            import colorama
+            colorama.init()
         self.log_file = log_file
         self.datefmt = datefmt
+        self.level = LEVELS[level]
 
         os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
+    def set_level(self, level: str):
+        self.level = LEVELS[level]
+
     def log(self, level, message):
+        if LEVELS.get(level, 0) < self.level:
+            return
         asctime = datetime.now().strftime(self.datefmt)
 
         match level:
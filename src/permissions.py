@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import re
+
+from src.identity import irc_lower
+
+
+def mask_pattern(mask):
+    """
+    Compile an IRC mask where only * and ? are wildcards, so brackets in
+    nicks like Nick[m] match literally.
+    """
+    return re.compile(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in mask), re.DOTALL)
+
+
+class PermissionTable:
+    """
+    Maps accounts and hostmasks to roles.
+
+    Accounts and masks of the form *!*@host are stored in dicts, so the
+    common checks are a couple of lookups. Other masks are compiled to
+    regexes and only tried when the lookups fail. Names are compared with
+    RFC 1459 casemapping.
+    """
+
+    def __init__(self, accounts=None, masks=None):
+        """
+        :param accounts: Dict of account name -> list of roles
+        :param masks: Dict of nick!user@host mask (wildcards allowed) -> list of roles
+        """
+        self.accounts = {}
+        self.hosts = {}
+        self.patterns = []
+
+        for account, roles in (accounts or {}).items():
+            self.accounts[irc_lower(account)] = frozenset(roles)
+        for mask, roles in (masks or {}).items():
+            mask = irc_lower(mask)
+            host = mask[4:]
+            if mask.startswith('*!*@') and not any(c in host for c in '*?'):
+                self.hosts[host] = frozenset(roles)
+            else:
+                self.patterns.append((mask_pattern(mask), frozenset(roles)))
+
+    def roles(self, identity):
+        """
+        Return the set of roles granted to an Identity.
+        """
+        if identity is None:
+            return frozenset()
+        roles = set()
+        if identity.account:
+            roles |= self.accounts.get(irc_lower(identity.account), frozenset())
+        if identity.host:
+            roles |= self.hosts.get(irc_lower(identity.host), frozenset())
+        if self.patterns:
+            hostmask = irc_lower(identity.hostmask)
+            for pattern, pattern_roles in self.patterns:
+                if pattern.fullmatch(hostmask):
+                    roles |= pattern_roles
+        return roles
+
+    def check(self, identity, role):
+        """
+        Return True if the Identity has role.
+        """
+        if identity is None:
+            return False
+        if identity.account and role in self.accounts.get(irc_lower(identity.account), ()):
+            return True
+        if identity.host and role in self.hosts.get(irc_lower(identity.host), ()):
+            return True
+        hostmask = irc_lower(identity.hostmask)
+        return any(role in roles and pattern.fullmatch(hostmask) for pattern, roles in self.patterns)
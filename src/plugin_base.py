@@ -1,4 +1,7 @@
 class PluginBase:
+    # Roles required to run commands, e.g. {'echo': 'admin'}
+    command_roles = {}
+
     def __init__(self, bot_instance):
         """
         Constructor for the base plugin.
@@ -36,6 +39,15 @@ class PluginBase:
         """
         pass
 
+    def on_config_change(self, settings):
+        """
+        Called when the config is reloaded and this plugin's section under
+        Plugins (keyed by class name) changed.
+
+        :param settings: The new settings dict
+        """
+        pass
+
     def on_disconnect(self):
         """
         Called when the bot disconnects from the server.
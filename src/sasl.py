@@ -10,7 +10,7 @@ async def handle_sasl(config, ircsend):
     Handles SASL authentication by sending an AUTHENTICATE command.
 
     Parameters:
-    config (dict): Configuration dictionary
+    config (Config): Bot configuration
     ircsend (function): Function to send IRC commands
     """
     await ircsend('AUTHENTICATE PLAIN')
@@ -22,14 +22,14 @@ async def handle_authenticate(args, config, ircsend):
 
     Parameters:
     args (list): List of arguments from the AUTHENTICATE command
-    config (dict): Configuration dictionary
+    config (Config): Bot configuration
     ircsend (function): Function to send IRC commands
     """
     if args[0] == '+':
-        if 'SASLNick' in config['SASL'] and 'SASLPassword' in config['SASL']:
-            authpass = (f'{config["SASL"]["SASLNick"]}{NULL_BYTE}'
-                        f'{config["SASL"]["SASLNick"]}{NULL_BYTE}'
-                        f'{config["SASL"]["SASLPassword"]}')
+        if config.sasl.nick and config.sasl.password:
+            authpass = (f'{config.sasl.nick}{NULL_BYTE}'
+                        f'{config.sasl.nick}{NULL_BYTE}'
+                        f'{config.sasl.password}')
             ap_encoded = base64.b64encode(authpass.encode(ENCODING)).decode(ENCODING)
             await ircsend(f'AUTHENTICATE {ap_encoded}')
         else:
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """
+    Records how long each startup phase took and when it started, relative
+    to the creation of the profiler. Phases may overlap since database and
+    plugin initialization run in the background.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reported = False
+        self.origin = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start - self.origin, time.perf_counter() - start))
+
+    def mark(self, name):
+        self.phases.append((name, time.perf_counter() - self.origin, 0.0))
+
+    def report(self):
+        lines = ['Startup profile (start offset, duration):']
+        for name, start, duration in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append(f'  {name:<24} +{start * 1000:8.1f} ms  {duration * 1000:8.1f} ms')
+        return lines
@@ -0,0 +1,46 @@
+import time
+
+from src.archive import TrafficArchive, query, stream_name
+from src.logger import Logger
+
+
+def test_stream_name_strips_tags_and_prefix():
+    line = '@time=2024-01-01T00:00:00.000Z :n!u@h PRIVMSG #Chan :hello world'
+    assert stream_name(line) == '#chan'
+    assert stream_name('@account=x :n!u@h PRIVMSG EliteBot :hi') == '_private'
+    assert stream_name(':srv 001 EliteBot :Welcome') == '_server'
+
+
+def test_tagged_line_round_trips_through_query(tmp_path):
+    logger = Logger(str(tmp_path / 'logs' / 'test.log'))
+    archive = TrafficArchive(str(tmp_path / 'archive'), 'net', logger, block_lines=2, flush_interval=0.1)
+    start = time.time()
+    archive.record('<', '@time=2024-01-01T00:00:00.000Z :n!u@h PRIVMSG #chan :hello world')
+    archive.record('>', '@label=1 AUTHENTICATE c2VjcmV0')
+    archive.close()
+
+    lines = list(query(str(tmp_path / 'archive'), 'net', '#chan', start, time.time()))
+    assert len(lines) == 1
+    assert lines[0].endswith('< @time=2024-01-01T00:00:00.000Z :n!u@h PRIVMSG #chan :hello world')
+
+    server = list(query(str(tmp_path / 'archive'), 'net', '_server', start, time.time()))
+    assert [line.split(' ', 2)[2] for line in server] == ['AUTHENTICATE *']
+
+
+def test_idle_segments_are_closed_and_reopened_for_append(tmp_path):
+    logger = Logger(str(tmp_path / 'logs' / 'test.log'))
+    archive = TrafficArchive(str(tmp_path / 'archive'), 'net', logger, block_lines=1, flush_interval=60,
+                             max_open_segments=2)
+    start = time.time()
+    for round in range(2):
+        for i in range(5):
+            archive.append(time.time(), '<', f':n!u@h PRIVMSG #chan{i} :round {round}')
+            assert len(archive.open_segments) <= 2
+            assert sum(segment.is_open for segment in archive.open_segments) == len(archive.open_segments)
+    archive.close()
+
+    assert not archive.open_segments
+    for i in range(5):
+        lines = list(query(str(tmp_path / 'archive'), 'net', f'#chan{i}', start, time.time()))
+        assert [line.rsplit(' ', 1)[1] for line in lines] == ['0', '1']
+        assert len(list((tmp_path / 'archive' / 'net' / f'#chan{i}').glob('*.seg'))) == 1
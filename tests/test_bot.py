@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+
+from src.bot import Bot
+
+CONFIG = {
+    'Connection': {'Hostname': 'irc.example.net', 'Port': '6667', 'Nick': 'EliteBot', 'Ident': 'e', 'Name': 'E'},
+    'Database': {'ConnectionString': 'sqlite://'},
+    'Logging': {'Level': 'error'},
+    'Permissions': {'Accounts': {'alice': ['admin']}},
+}
+
+
+class FakeReader:
+    def __init__(self, bot, chunks):
+        self.bot = bot
+        self.chunks = chunks
+
+    async def read(self, n):
+        await asyncio.sleep(0.01)
+        if self.chunks:
+            return self.chunks.pop(0)
+        self.bot.running = False
+        return b''
+
+
+class FakeWriter:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode().splitlines())
+
+    async def drain(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.saved = []
+
+    def _save_channel(self, channel):
+        self.saved.append(channel)
+
+
+def make_bot(tmp_path, monkeypatch, chunks, config=CONFIG):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    bot = Bot('config.json')
+    bot.ready.set()
+    bot.init_task = asyncio.Future()
+    bot.build_command_roles()
+    bot.channel_manager.db = FakeDatabase()
+    writer = FakeWriter()
+
+    async def connect():
+        bot.reader, bot.writer = FakeReader(bot, chunks), writer
+
+    bot.connect = connect
+    return bot, writer
+
+
+def test_join_waiting_on_whox_does_not_block_read_loop(tmp_path, monkeypatch):
+    async def run():
+        bot, writer = make_bot(tmp_path, monkeypatch, [
+            b':srv 005 EliteBot WHOX :are supported\r\n',
+            b':alice!a@h PRIVMSG #c :&join #new\r\n',
+            b':srv 354 EliteBot 152 * a h alice alice\r\n:srv 315 EliteBot alice :End of /WHO\r\n',
+        ])
+        started = time.monotonic()
+        await bot.start()
+        await asyncio.gather(*bot.tasks)
+        return bot, writer, time.monotonic() - started
+
+    bot, writer, elapsed = asyncio.run(run())
+    assert 'WHO alice %tcuhna,152' in writer.lines
+    assert 'JOIN #new' in writer.lines
+    assert 'PRIVMSG #c :alice: Joined #new' in writer.lines
+    assert bot.channel_manager.db.saved == ['#new']
+    assert elapsed < bot.identity.timeout
+
+
+def test_failed_initialization_still_replays_and_becomes_ready(tmp_path, monkeypatch):
+    async def run():
+        bot, writer = make_bot(tmp_path, monkeypatch, [])
+        bot.ready.clear()
+        bot.channel_manager.db = None
+        bot.channel_manager.load = lambda: 1 / 0
+
+        def broken_import():
+            raise ImportError('broken plugin')
+
+        bot.import_plugins = broken_import
+        bot.writer = writer
+        await bot.process_message('@account=alice :alice!a@h PRIVMSG #c :&join #new')
+        assert len(bot.pending_events) == 1
+        await bot.initialize()
+        await asyncio.gather(*bot.tasks)
+        return bot, writer
+
+    bot, writer = asyncio.run(run())
+    assert bot.ready.is_set()
+    assert not bot.pending_events
+    assert 'JOIN #new' in writer.lines
+    assert ('PRIVMSG #c :alice: Joined #new, but the database is unavailable so it will not be rejoined '
+            'after a restart') in writer.lines
+
+
+def test_line_split_across_reads_is_joined_before_parsing(tmp_path, monkeypatch):
+    config = dict(CONFIG, Permissions={'Masks': {'*!*@admin.host': ['admin']}})
+
+    async def run():
+        bot, writer = make_bot(tmp_path, monkeypatch, [
+            b':evil!e@evil.host PRIVMSG #c :xxxxxxxxxx',
+            b':admin!a@admin.host PRIVMSG #c :&join #pwn\r\n',
+            b':admin!a@admin.host PRIVMSG #c :&jo',
+            b'in #new\r\n',
+        ], config)
+        await bot.start()
+        await asyncio.gather(*bot.tasks)
+        return bot, writer
+
+    bot, writer = asyncio.run(run())
+    assert 'JOIN #pwn' not in writer.lines
+    assert 'JOIN #new' in writer.lines
+    assert bot.identity.get('admin').host == 'admin.host'
+    assert bot.history.recent('#c', 2)[0].text == 'xxxxxxxxxx:admin!a@admin.host PRIVMSG #c :&join #pwn'
+
+
+def test_plugins_see_lines_in_order_while_a_command_waits(tmp_path, monkeypatch):
+    seen = []
+
+    class Recorder:
+        async def handle_message(self, nick, channel, text):
+            await asyncio.sleep(0.01 if text == 'first' else 0)
+            seen.append(text)
+
+    async def run():
+        bot, writer = make_bot(tmp_path, monkeypatch, [
+            b':srv 005 EliteBot WHOX :are supported\r\n',
+            b':alice!a@h PRIVMSG #c :&join #new\r\n:bob!b@h PRIVMSG #c :first\r\n:bob!b@h PRIVMSG #c :second\r\n',
+            b':srv 354 EliteBot 152 * a h alice alice\r\n:srv 315 EliteBot alice :End of /WHO\r\n',
+        ])
+        bot.plugins = [Recorder()]
+        await bot.start()
+        await asyncio.gather(*bot.tasks)
+        return writer
+
+    writer = asyncio.run(run())
+    assert seen == ['&join #new', 'first', 'second']
+    assert 'JOIN #new' in writer.lines
+
+
+def test_labeled_reply_reaches_request_during_startup(tmp_path, monkeypatch):
+    async def run():
+        bot, writer = make_bot(tmp_path, monkeypatch, [])
+        bot.ready.clear()
+        bot.writer = writer
+        bot.caps.enabled.add('labeled-response')
+        task = asyncio.create_task(bot.caps.request('WHOIS alice', timeout=1))
+        await asyncio.sleep(0)
+        await bot.process_message('@label=1 :srv 311 EliteBot alice a h * :Alice')
+        return await task, bot
+
+    result, bot = asyncio.run(run())
+    assert [command for _, _, command, _ in result] == ['311']
+    assert list(bot.pending_events) == ['@label=1 :srv 311 EliteBot alice a h * :Alice']
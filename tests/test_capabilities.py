@@ -0,0 +1,173 @@
+import asyncio
+
+from src.capabilities import MAX_REQ_LENGTH, CapabilityManager
+
+
+class FakeLogger:
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+
+class FakeSASL:
+    def __init__(self, use_sasl):
+        self.use_sasl = use_sasl
+
+
+class FakeConfig:
+    def __init__(self, use_sasl):
+        self.sasl = FakeSASL(use_sasl)
+
+
+class FakeBot:
+    def __init__(self, use_sasl=False):
+        self.config = FakeConfig(use_sasl)
+        self.logger = FakeLogger()
+        self.sent = []
+
+    async def ircsend(self, msg):
+        self.sent.append(msg)
+
+
+def negotiate(wanted, lines, use_sasl=False):
+    """
+    Start negotiation and feed it CAP replies, returning the manager and what was sent.
+    """
+    bot = FakeBot(use_sasl)
+    caps = CapabilityManager(bot, wanted)
+
+    async def run():
+        await caps.start()
+        for args in lines:
+            await caps.handle(args)
+
+    asyncio.run(run())
+    return caps, bot.sent
+
+
+def test_multi_line_ls_is_merged_before_requesting():
+    caps, sent = negotiate(['server-time', 'batch', 'sasl'], [
+        ['*', 'LS', '*', 'server-time multi-prefix'],
+        ['*', 'LS', 'batch sasl=PLAIN,EXTERNAL'],
+    ])
+    assert caps.available == {'server-time': '', 'multi-prefix': '', 'batch': '', 'sasl': 'PLAIN,EXTERNAL'}
+    assert sent == ['CAP LS 302', 'CAP REQ :batch sasl server-time']
+
+
+def test_requests_are_split_below_max_length():
+    wanted = [f'vendor.example/capability-{i:03d}' for i in range(40)]
+    caps, sent = negotiate(wanted, [['*', 'LS', ' '.join(wanted)]])
+
+    requests = [line[len('CAP REQ :'):] for line in sent[1:]]
+    assert len(requests) > 1
+    assert all(len(line) <= MAX_REQ_LENGTH for line in requests)
+    assert sorted(' '.join(requests).split()) == sorted(wanted)
+    assert caps.pending == set(wanted)
+
+
+def test_ack_and_nak_end_negotiation():
+    caps, sent = negotiate(['server-time', 'batch'], [
+        ['*', 'LS', 'server-time batch'],
+        ['*', 'NAK', 'batch server-time'],
+    ])
+    assert sent[-1] == 'CAP END'
+    assert not caps.enabled
+
+    caps, sent = negotiate(['server-time', 'batch'], [
+        ['*', 'LS', 'server-time batch'],
+        ['*', 'ACK', 'batch server-time'],
+    ])
+    assert sent[-1] == 'CAP END'
+    assert caps.enabled == {'batch', 'server-time'}
+    assert not caps.negotiating
+
+
+def test_sasl_ack_authenticates_instead_of_ending():
+    caps, sent = negotiate(['server-time'], [
+        ['*', 'LS', 'server-time sasl'],
+        ['*', 'ACK', 'sasl server-time'],
+    ], use_sasl=True)
+    assert sent == ['CAP LS 302', 'CAP REQ :sasl server-time', 'AUTHENTICATE PLAIN']
+    assert caps.negotiating
+
+    # Without UseSASL the capability is never requested
+    caps, sent = negotiate(['server-time'], [['*', 'LS', 'server-time sasl'], ['*', 'ACK', 'server-time']])
+    assert sent == ['CAP LS 302', 'CAP REQ :server-time', 'CAP END']
+
+
+def test_new_and_del_at_runtime():
+    caps, sent = negotiate(['server-time', 'away-notify'], [
+        ['*', 'LS', 'server-time'],
+        ['*', 'ACK', 'server-time'],
+    ])
+    caps.registered()
+
+    async def run():
+        await caps.handle(['EliteBot', 'NEW', 'away-notify chghost'])
+        await caps.handle(['EliteBot', 'ACK', 'away-notify'])
+        await caps.handle(['EliteBot', 'DEL', 'server-time'])
+
+    asyncio.run(run())
+    assert sent[3:] == ['CAP REQ :away-notify']
+    assert caps.enabled == {'away-notify'}
+    assert 'server-time' not in caps.available
+
+
+def test_sync_drops_unwanted_caps():
+    caps, sent = negotiate(['server-time', 'batch'], [
+        ['*', 'LS', 'server-time batch cap-notify'],
+        ['*', 'ACK', 'batch server-time'],
+    ])
+    caps.registered()
+    caps.wanted = {'server-time'}
+
+    async def run():
+        await caps.sync()
+        await caps.handle(['EliteBot', 'ACK', '-batch'])
+
+    asyncio.run(run())
+    assert sent[-1] == 'CAP REQ :-batch'
+    assert caps.enabled == {'server-time'}
+
+
+def run_request(replies):
+    """
+    Run request() while feeding (tags, source, command, args) replies to handle_tags.
+    """
+    bot = FakeBot()
+    caps = CapabilityManager(bot)
+    caps.enabled.add('labeled-response')
+
+    async def run():
+        task = asyncio.create_task(caps.request('WHOIS alice', timeout=1))
+        await asyncio.sleep(0)
+        for tags, source, command, args in replies:
+            caps.handle_tags(tags, source, command, args)
+        return await task
+
+    return asyncio.run(run()), bot.sent, caps
+
+
+def test_request_resolves_on_single_labeled_reply():
+    result, sent, caps = run_request([({'label': '1'}, 'srv', '301', ['EliteBot', 'alice', 'away'])])
+    assert sent == ['@label=1 WHOIS alice']
+    assert result == [({'label': '1'}, 'srv', '301', ['EliteBot', 'alice', 'away'])]
+    assert not caps.responses
+
+
+def test_request_collects_labeled_batch():
+    result, _, caps = run_request([
+        ({'label': '1'}, 'srv', 'BATCH', ['+b1', 'labeled-response']),
+        ({'batch': 'b1'}, 'srv', '311', ['EliteBot', 'alice']),
+        ({'batch': 'b1'}, 'srv', '318', ['EliteBot', 'alice']),
+        ({}, 'srv', 'BATCH', ['-b1']),
+    ])
+    assert [command for _, _, command, _ in result] == ['311', '318']
+    assert not caps.batches
+
+
+def test_request_resolves_empty_on_bare_ack():
+    result, _, _ = run_request([({'label': '1'}, 'srv', 'ACK', [])])
+    assert result == []
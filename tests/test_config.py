@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from src.bot import Bot
+from src.config import ConfigError, diff_config, load_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = {
+    'Connection': {'Hostname': 'irc.example.net', 'Port': '+6697', 'Nick': 'EliteBot', 'Ident': 'e', 'Name': 'E'},
+    'Database': {'ConnectionString': 'sqlite://'},
+    'Logging': {'Level': 'error'},
+    'History': {'MaxLinesPerChannel': 100},
+}
+
+
+def write_config(tmp_path, data, name='config.json'):
+    path = tmp_path / name
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def with_changes(section, **values):
+    data = json.loads(json.dumps(CONFIG))
+    data.setdefault(section, {}).update(values)
+    return data
+
+
+def test_example_json_and_yaml_configs_are_equivalent():
+    json_config = load_config(os.path.join(ROOT, 'config.json'))
+    yaml_config = load_config(os.path.join(ROOT, 'config.yaml'))
+    assert json_config == yaml_config
+    assert json_config.connection.tls and json_config.connection.port == 6697
+
+
+@pytest.mark.parametrize('data, message', [
+    ([], 'Invalid config: expected a mapping at the top level, got list'),
+    ({'Database': CONFIG['Database']}, 'Missing required config field: Connection -> Port'),
+    (with_changes('Connection', Port='+port'), 'Invalid config field Connection -> Port: expected a port number'),
+    (with_changes('Connection', Port=70000), 'Invalid config field Connection -> Port: expected a port number '
+                                             'between 1 and 65535'),
+    (with_changes('History', MaxLinesPerChannel='100'), 'Invalid config field History -> MaxLinesPerChannel: '
+                                                        'expected integer, got str'),
+    (with_changes('History', MaxMemoryMB=0), 'Invalid config field History -> MaxMemoryMB: must be greater than 0'),
+    (with_changes('SASL', UseSASL=True), 'Missing required config field: SASL -> SASLNick'),
+    (with_changes('Logging', Level='loud'), 'Invalid config field Logging -> Level: expected one of'),
+    (with_changes('Permissions', Accounts={'alice': ['admin', 1]}), 'Invalid config field Permissions -> '
+                                                                   'Accounts -> alice -> 1: expected string'),
+    (dict(CONFIG, Channels='#chan'), 'Invalid config field Channels: expected list, got str'),
+])
+def test_invalid_config_errors_name_the_field(tmp_path, data, message):
+    with pytest.raises(ConfigError) as error:
+        load_config(write_config(tmp_path, data))
+    assert str(error.value).startswith(message)
+
+
+def test_unreadable_config_files(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_config(str(tmp_path / 'missing.json'))
+
+    (tmp_path / 'broken.json').write_text('{"Connection": ')
+    with pytest.raises(ConfigError, match='Error parsing config file .*broken.json'):
+        load_config(str(tmp_path / 'broken.json'))
+
+    (tmp_path / 'broken.yaml').write_text('Connection: [')
+    with pytest.raises(ConfigError, match='Error parsing config file .*broken.yaml'):
+        load_config(str(tmp_path / 'broken.yaml'))
+
+    (tmp_path / 'config.ini').write_text('')
+    with pytest.raises(ConfigError, match='Unsupported file extension: .ini'):
+        load_config(str(tmp_path / 'config.ini'))
+
+
+def test_diff_config_reports_config_keys(tmp_path):
+    old = load_config(write_config(tmp_path, CONFIG))
+    data = with_changes('Connection', Port='6667', Nick='NewBot')
+    data['Archive'] = {'Enabled': True, 'MaxOpenSegments': 8}
+    data['History'] = {'MaxLinesPerChannel': 50}
+    new = load_config(write_config(tmp_path, data))
+
+    changed, reconnect, restart = diff_config(old, new)
+    assert changed == ['connection', 'history', 'archive']
+    assert reconnect == ['Connection -> Port', 'Connection -> Nick']
+    assert restart == ['Archive -> Enabled', 'Archive -> MaxOpenSegments']
+    assert diff_config(old, old) == ([], [], [])
+
+
+def test_reload_applies_live_sections_and_defers_the_rest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_config(tmp_path, CONFIG)
+
+    async def refuse(*args, **kwargs):
+        raise OSError('no network in tests')
+
+    async def run():
+        bot = Bot('config.json')
+        bot.history.add('#chan', 'alice', 'hello', timestamp=1)
+        data = with_changes('Connection', Nick='NewBot')
+        data['History'] = {'MaxLinesPerChannel': 5}
+        data['Archive'] = {'Enabled': True}
+        write_config(tmp_path, data)
+        result = await bot.reload_config()
+        live = (bot.config.connection.nick, bot.config.archive.enabled, bot.history.max_lines_per_channel,
+                bot.history.channels['#chan'].capacity)
+
+        # Invalid files are rejected and the current config is kept
+        (tmp_path / 'config.json').write_text('{')
+        failed = await bot.reload_config()
+
+        monkeypatch.setattr(asyncio, 'open_connection', refuse)
+        await bot.connect()
+        return result, live, failed, bot
+
+    result, live, failed, bot = asyncio.run(run())
+    assert result == (['connection', 'history', 'archive'], ['Connection -> Nick'], ['Archive -> Enabled'])
+    assert live == ('EliteBot', False, 5, 5)
+    assert failed is None
+    # The new nick is used from the next connection attempt, the archive still needs a restart
+    assert bot.config.connection.nick == 'NewBot'
+    assert not bot.config.archive.enabled
@@ -0,0 +1,107 @@
+import re
+
+from src.history import MessageHistory
+
+
+def fill(history, count):
+    for i in range(count):
+        history.add('#chan', 'alice' if i % 2 else 'bob', f'line {i} about python', timestamp=i)
+
+
+def test_set_limits_shrinks_existing_channels():
+    history = MessageHistory(max_lines_per_channel=10)
+    fill(history, 15)
+    history.set_limits(4, history.max_bytes)
+
+    assert [entry.text for entry in history.recent('#chan', 10)] == [f'line {i} about python' for i in range(11, 15)]
+    assert history.total_lines == 4
+    assert history.last_by('#chan', 'bob').text == 'line 14 about python'
+    assert history.last_matching('#chan', re.compile('line 1[0-2]'), nick='alice').text == 'line 11 about python'
+    assert history.last_matching('#chan', 'line 12 about').text == 'line 12 about python'
+    assert [entry.timestamp for entry in history.between('#chan', 12, 13)] == [12, 13]
+
+    fill(history, 3)
+    assert len(history.recent('#chan', 10)) == 4
+
+
+def test_set_limits_grows_existing_channels():
+    history = MessageHistory(max_lines_per_channel=3)
+    fill(history, 5)
+    history.set_limits(6, history.max_bytes)
+    for i in range(5, 10):
+        history.add('#chan', 'carol', f'line {i}', timestamp=i)
+
+    assert [entry.timestamp for entry in history.recent('#chan', 10)] == [4, 5, 6, 7, 8, 9]
+    assert history.last_by('#chan', 'alice') is None
+
+
+def test_global_cap_evicts_oldest_lines_across_channels():
+    history = MessageHistory(max_lines_per_channel=100)
+    for i in range(30):
+        history.add(f'#chan{i % 3}', 'alice', f'message number {i}', timestamp=i)
+    history.set_limits(100, history.total_bytes - 1)
+
+    assert history.memory_usage() <= history.max_bytes
+    stored = sorted(entry.timestamp for channel in ('#chan0', '#chan1', '#chan2')
+                    for entry in history.recent(channel, 100))
+    assert stored == list(range(30 - len(stored), 30))
+
+    # A channel whose lines are all evicted is dropped together with its overhead
+    history.add('#quiet', 'bob', 'only line', timestamp=0)
+    for i in range(30, 40):
+        history.add('#busy', 'alice', f'message number {i}', timestamp=i)
+    assert '#quiet' not in history.channels
+    assert history.memory_usage() <= history.max_bytes
+
+
+def test_memory_accounting_returns_to_zero_when_everything_is_evicted():
+    history = MessageHistory(max_lines_per_channel=5)
+    for i in range(20):
+        history.add(f'#chan{i % 4}', f'nick{i % 7}', f'some words here {i}', timestamp=i)
+    history.set_limits(5, 0)
+    assert history.total_lines == 1
+    history.add('#last', 'zed', 'x', timestamp=100)
+    history.set_limits(5, 0)
+    buffer = history.channels['#last']
+    assert list(history.channels) == ['#last']
+    assert history.memory_usage() == buffer.bytes + history.nicks.bytes
+
+
+def test_nick_ids_are_recycled_after_release():
+    history = MessageHistory(max_lines_per_channel=2)
+    history.add('#chan', 'Alice', 'one', timestamp=1)
+    alice = history.nicks.lookup('alice')
+    history.add('#chan', 'bob', 'two', timestamp=2)
+    history.add('#chan', 'carol', 'three', timestamp=3)
+
+    assert history.nicks.lookup('alice') is None
+    assert history.nicks.lookup('carol') == alice
+    assert len(history.nicks) == 2
+    assert history.last_by('#chan', 'carol').nick == 'carol'
+
+
+def test_last_matching_uses_the_index_after_eviction():
+    history = MessageHistory(max_lines_per_channel=4)
+    for i in range(10):
+        history.add('#chan', 'alice', f'the python release {i}' if i % 2 else f'other text {i}', timestamp=i)
+
+    assert history.last_matching('#chan', ' python ').text == 'the python release 9'
+    assert history.last_matching('#chan', 'python release 5') is None
+    assert history.last_matching('#chan', ' text ').text == 'other text 8'
+    # Evicted postings are dropped lazily, never outweighing the live ones
+    buffer = history.channels['#chan']
+    postings = list(buffer.tokens['python'])
+    assert [seq for seq in postings if seq >= buffer.start] == [7, 9]
+    assert len(postings) <= 4
+    assert history.last_matching('#chan', ' python ', nick='alice').text == 'the python release 9'
+
+
+def test_between_clamps_non_monotonic_timestamps():
+    history = MessageHistory()
+    for timestamp in (10, 12, 11, 15, 14, 20):
+        history.add('#chan', 'alice', f'at {timestamp}', timestamp=timestamp)
+
+    assert [entry.timestamp for entry in history.recent('#chan', 10)] == [10, 12, 12, 15, 15, 20]
+    assert [entry.text for entry in history.between('#chan', 12, 15)] == ['at 12', 'at 11', 'at 15', 'at 14']
+    assert [entry.text for entry in history.between('#chan', 16)] == ['at 20']
+    assert history.between('#chan', 13, 14) == []
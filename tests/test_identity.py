@@ -0,0 +1,87 @@
+import asyncio
+
+from src.identity import Identity, IdentityService
+from src.permissions import PermissionTable
+
+
+class FakeCaps:
+    def __init__(self, *caps):
+        self.enabled = set(caps)
+
+    def has(self, cap):
+        return cap in self.enabled
+
+
+class FakeConnection:
+    nick = 'EliteBot'
+
+
+class FakeConfig:
+    connection = FakeConnection()
+
+
+class FakeBot:
+    def __init__(self, *caps):
+        self.caps = FakeCaps(*caps)
+        self.config = FakeConfig()
+        self.sent = []
+
+    async def ircsend(self, msg):
+        self.sent.append(msg)
+
+
+def test_account_is_cleared_when_user_or_host_changes():
+    identity = IdentityService(FakeBot())
+    identity.update('Admin', 'a', 'admin.example', 'admin')
+    identity.observe('Admin!x@elsewhere.example', {})
+    assert identity.get('admin').account is None
+
+
+def test_part_and_kick_drop_users_without_shared_channels():
+    identity = IdentityService(FakeBot())
+    identity.on_join('admin!a@h', ['#one'])
+    identity.on_join('admin!a@h', ['#two'])
+    identity.update('admin', account='admin')
+    identity.on_part('admin!a@h', ['#one'])
+    assert identity.get('admin').account == 'admin'
+    identity.on_kick(['#two', 'admin', 'bye'])
+    assert identity.get('admin') is None
+
+    identity.on_join('other!o@h', ['#three'])
+    identity.on_part('EliteBot!e@h', ['#three'])
+    assert identity.get('other') is None
+
+
+def test_lookups_are_batched_when_targmax_allows():
+    async def run():
+        bot = FakeBot()
+        identity = IdentityService(bot, timeout=1)
+        identity.on_isupport(['EliteBot', 'WHOX', 'TARGMAX=PRIVMSG:4,WHO:3', 'are supported'])
+        lookups = [asyncio.create_task(identity.resolve(nick)) for nick in ('a', 'b', 'c', 'd')]
+        await asyncio.sleep(0.01)
+        identity.on_whox(['EliteBot', '152', '*', 'u', 'h', 'a', 'acct'])
+        identity.on_end_of_who(['EliteBot', 'a,b,c', 'End of /WHO'])
+        identity.on_end_of_who(['EliteBot', 'd', 'End of /WHO'])
+        return bot.sent, await asyncio.gather(*lookups)
+
+    sent, results = asyncio.run(run())
+    assert sent == ['WHO a,b,c %tcuhna,152', 'WHO d %tcuhna,152']
+    assert results[0].account == 'acct'
+    assert results[1:] == [None, None, None]
+
+
+def test_masks_match_brackets_literally_with_irc_casemapping():
+    permissions = PermissionTable(masks={'Nick[m]!*@*': ['admin'], '*!*@Host.Example': ['op']})
+    assert permissions.check(Identity('nick{M}', 'u', 'h'), 'admin')
+    assert not permissions.check(Identity('nickm', 'u', 'h'), 'admin')
+    assert permissions.check(Identity('x', 'u', 'host.example'), 'op')
+
+
+def test_lowering_max_entries_trims_cache():
+    identity = IdentityService(FakeBot())
+    for i in range(5):
+        identity.update(f'user{i}', 'u', 'h', 'acct')
+    identity.set_max_entries(2)
+    assert list(identity.entries) == ['user3', 'user4']
+    identity.update('user5', 'u', 'h')
+    assert list(identity.entries) == ['user4', 'user5']